@@ -7,10 +7,43 @@
 # ]
 # ///
 import os
-import requests
+import json
+import time
 import base64
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor, CancelledError, as_completed
 from fastapi import FastAPI
-GITHUB_TOKEN = os.getenv("GITHUB_TOKEN") 
+from fastapi.responses import JSONResponse, PlainTextResponse
+from jobs import JobQueue, stage, bind_job, log, current_job, checkpoint
+from fair_queue import QueueFull, MAX_RETRY_AFTER
+from http_client import llm
+from github_scheduler import github
+from repo_state import repo_state, git_blob_sha
+from attachments import parse_attachments, check_attachment_sizes, attachment_bytes, repo_path
+from prompt_budget import ATTACHMENTS_SLOT, fill_attachments, count_tokens
+from llm_cache import llm_cache, cache_key
+from llm_router import llm_router
+from outbox import outbox
+from repo_pool import RepoPool
+from pages_tracker import PagesTracker, PAGES_WAIT
+from local_checks import local_checker
+from code_edits import (EDIT_FORMAT, parse_edits, apply_edits, looks_like_html, strip_fences,
+                        html_stream_error, edit_stream_error)
+import metrics
+GITHUB_API = os.getenv("GITHUB_API_URL", "https://api.github.com")
+LLM_API_URL = os.getenv("LLM_API_URL", "https://aipipe.org/openai/v1/chat/completions")
+LLM_MAX_TOKENS = int(os.getenv("LLM_MAX_TOKENS", "1000"))
+# Streamed generations rejected early are retried this many times
+LLM_STREAM_RETRIES = int(os.getenv("LLM_STREAM_RETRIES", "2"))
+STREAM_VALIDATE_CHARS = 512
+# "patch" asks for SEARCH/REPLACE edits to the current index.html in round 2, "full" regenerates it
+ROUND2_MODE = os.getenv("ROUND2_MODE", "patch")
+# "commit" pushes every file in one Git Data API commit, "contents" does one PUT per file
+PUSH_MODE = os.getenv("PUSH_MODE", "commit")
+# Full generations sampled in parallel when the task has checks that can run locally;
+# the first candidate passing all of them is pushed. 1 turns this off
+LLM_CANDIDATES = int(os.getenv("LLM_CANDIDATES", "1"))
 
 def validate_secret(secret: str) -> bool:
     return secret == os.getenv("SECRET_KEY")
@@ -18,20 +51,73 @@ def validate_secret(secret: str) -> bool:
 
 
 def round1(data):
+    # Not checkpointed: parsing is cheap and redone from the job's saved input on resume
     if data.get("attachments", []):
-        attachfiles = parse_attachments(data)
+        with stage("parse_attachments"):
+            attachfiles = parse_attachments(data)
     else:
         attachfiles = None
+    # Attachments are committed next to index.html; the prompt only has what fits the budget
+    extra_files = attachment_files(attachfiles)
+
+    repo_name = f"{data['task']}-{data['nonce']}"
+
+    def generate():
+        with stage("prompt"):
+            prompt = build_round1_prompt(data, attachfiles)
+        with stage("llm"):
+            return write_checked_code(prompt, data["brief"], data.get("checks", []), extra_files,
+                                      use_cache=not data.get("no_cache", False))
+
+    # Every step is checkpointed, a job resumed after a restart skips the ones already done.
+    # Repo setup doesn't depend on the generated code, run it alongside the LLM call
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        bootstrap = pool.submit(bind_job(checkpoint), "repo", functools.partial(prepare_repo, repo_name))
+        files = checkpoint("files", generate)
+        bootstrap.result()
+
+    files = files + extra_files
+
+    with stage("push"):
+        commit_sha = checkpoint("commit", lambda: push_files_to_pages(repo_name, files, 1))
+
+    # Send POST back to evaluation URL
+    with stage("evaluation"):
+        checkpoint("callback", lambda: post_evaluation(data, repo_name, commit_sha))
+    return repo_result(repo_name, commit_sha)
+
+def prepare_repo(repo_name: str):
+    with stage("claim_repo"):
+        claimed = repo_pool.claim(repo_name)
+    if not claimed:
+        bootstrap_repo(repo_name)
+
+def bootstrap_repo(repo_name: str):
+    with stage("create_repo"):
+        create_repo(repo_name)
+    with stage("enable_pages"):
+        enable_pages(repo_name)
+
+def attachment_files(attachfiles) -> list[dict]:
+    """
+    Attachments as files to push, at the paths the prompt gave the LLM, so
+    binary and condensed ones can be loaded by the page.
+    """
+    files = []
+    for f in attachfiles or []:
+        name = repo_path(f["name"])
+        if name in ("index.html", "README.md"):
+            log(f"Not committing attachment {f['name']}, it would overwrite {name}")
+            continue
+        files.append({**f, "name": name})
+    return files
+
+def build_round1_prompt(data: dict, attachfiles) -> str:
     if data.get("checks", []):
         checks = data["checks"]
     else:
         checks = None
 
-    if attachfiles:
-        attach_text = "\n\n".join([f"{f['name']}\n{f['content']}" for f in attachfiles])
-    else:
-        attach_text = "No attachments provided"
-
     if checks:
         checks_text = "\n".join(checks)
     else:
@@ -44,114 +130,169 @@ def round1(data):
     include only code files and no explanations or markdown formatting.
     The app should be contained in a single HTML file named index.html.
     The following are the attachments provided, you can use them as needed:
-    {attach_text}    -------------
+    {ATTACHMENTS_SLOT}    -------------
     it must pass the following checks:
     {checks_text}
 
     """
+    return fill_attachments(prompt, attachfiles, "No attachments provided")
 
-    files = write_code_with_llm(prompt)
-    
-    repo_name = f"{data['task']}-{data['nonce']}"
-    create_repo(repo_name)
-    enable_pages(repo_name)
-    
-    # Encode files to base64 before pushing
+def build_round2_prompt(subround: dict, repo_name: str, attachfiles: list[dict], current_code: str = None) -> str:
+    checks = subround.get("checks", [])
 
-    commit_sha = push_files_to_pages(repo_name, files, 1)
+    checks_text = "\n".join(checks) if checks else "No checks provided"
+    current_text = f"The current index.html is:\n{current_code}\n" if current_code else ""
 
-    # Send POST back to evaluation URL
-    post_evaluation(data, repo_name, commit_sha)
+    prompt = f"""
+    You are to modify the existing web app (index.html) based on this new brief:
+    {subround['brief']}
 
-def parse_attachments(data: dict)-> list[dict]:
-    """
-    Parse attachments array and decode data: URIs into file objects:
-    returns list of {"name": ..., "content": "..."}
+    The app already exists in the GitHub repository: {repo_name}
+    You must update the existing index.html to fulfill the new requirements.
+    {current_text}
+    Keep using HTML + JS + minimal CSS.
+    Maintain compatibility with GitHub Pages.
+
+    Attachments (if any) that you can use:
+    {ATTACHMENTS_SLOT}
+
+    It must pass the following checks:
+    {checks_text}
+
+    Include only code (no markdown or explanation).
+    The updated app must remain inside a single file: index.html.
     """
-    def safe_b64decode(b64_str: str):
-        # Strip whitespace/newlines
-        b64_str = b64_str.strip()
-        # Add padding if missing
-        missing_padding = len(b64_str) % 4
-        if missing_padding:
-            b64_str += "=" * (4 - missing_padding)
-        return base64.b64decode(b64_str)
-    
-    files = []
-    for att in data.get("attachments", []):
-        name = att.get("name")
-        url = att.get("url", "")
-        if not name or not url:
-            continue
-        if url.startswith("data:"):
-            try:
-                header, b64 = url.split(",", 1)
-                decoded = safe_b64decode(b64)
-                try:
-                    text = decoded.decode("utf-8")
-                    files.append({"name": name, "content": text, "binary": False})
-                except UnicodeDecodeError:
-                    b64_text = base64.b64encode(decoded).decode("utf-8")
-                    files.append({"name": name, "content": b64_text, "binary": True})
-            except Exception as e:
-                raise ValueError(f"Invalid data URI for attachment {name}: {e}")
-        else:
-            # non-data URIs are not fetched for security/simplicity; treat as placeholder
-            raise ValueError("Only data: attachments are supported by this service.")
-    return files
+    return fill_attachments(prompt, attachfiles, "No new attachments provided")
 
-def round2(data):
+def build_round2_edit_prompt(subround: dict, current_code: str, attachfiles: list[dict]) -> str:
+    checks = subround.get("checks", [])
 
-    repo_name = f"{data['task']}-{data['nonce']}"
-    
-    for i, subround in enumerate(data.get("round2", []), start=1):
-        print(f"--- Starting Round 2.{i} ---")
+    checks_text = "\n".join(checks) if checks else "No checks provided"
 
-        if subround.get("attachments", []):
-            attachfiles = parse_attachments(subround)
-        else:
-            attachfiles = []
+    prompt = f"""
+    You are to modify an existing web app (index.html) based on this new brief:
+    {subround['brief']}
 
-        checks = subround.get("checks", [])
+    This is the current index.html:
+    {current_code}
 
-        attach_text = "\n\n".join([f"{f['name']}\n{f['content']}" for f in attachfiles]) if attachfiles else "No new attachments provided"
-        checks_text = "\n".join(checks) if checks else "No checks provided"
+    Attachments (if any) that you can use:
+    {ATTACHMENTS_SLOT}
 
-        prompt = f"""
-        You are to modify the existing web app (index.html) based on this new brief:
-        {subround['brief']}
+    After your change it must pass the following checks:
+    {checks_text}
 
-        The app already exists in the GitHub repository: {repo_name}
-        You must update the existing index.html to fulfill the new requirements.
+    Do not rewrite the whole file. Reply only with one or more edit blocks in this exact format:
+    {EDIT_FORMAT}
+    The SEARCH text must be copied exactly from the current file and be just long enough to be unique.
+    No markdown or explanation outside the edit blocks.
+    """
+    return fill_attachments(prompt, attachfiles, "No new attachments provided")
 
-        Keep using HTML + JS + minimal CSS.
-        Maintain compatibility with GitHub Pages.
+def round2(data):
 
-        Attachments (if any) that you can use:
-        {attach_text}
+    repo_name = f"{data['task']}-{data['nonce']}"
+    use_cache = not data.get("no_cache", False)
+    subrounds = data.get("round2", [])
+    if data.get("fold_subrounds") and len(subrounds) > 1:
+        log(f"Folding {len(subrounds)} subrounds into one generation and commit")
+        subrounds = [fold_subrounds(subrounds)]
+    commits = [None] * len(subrounds)
+
+    def fetch_code():
+        with stage("fetch_code"):
+            try:
+                return get_file_content(repo_name, "index.html")
+            except Exception as e:
+                log(f"Could not fetch index.html, regenerating in full: {e}")
+                return None
+
+    def generate(subround, attachfiles, extra_files, current_code):
+        files = None
+        if current_code is not None:
+            with stage("prompt"):
+                prompt = build_round2_edit_prompt(subround, current_code, attachfiles)
+            with stage("llm"):
+                files = edit_code_with_llm(prompt, subround["brief"], current_code, use_cache=use_cache)
+            if files is None:
+                log("Edit did not apply, falling back to full regeneration")
+
+        if files is None:
+            with stage("prompt"):
+                prompt = build_round2_prompt(subround, repo_name, attachfiles, current_code)
+
+            # Generate the updated HTML with LLM
+            with stage("llm"):
+                files = write_checked_code(prompt, subround["brief"], subround.get("checks", []), extra_files,
+                                           use_cache=use_cache, max_tokens=full_rewrite_max_tokens(current_code))
+        return files
+
+    def publish(i, files, previous):
+        # Runs on the single push thread, so commits land in subround order
+        if previous is not None and previous.exception() is not None:
+            raise RuntimeError(f"Round 2.{i} not pushed, an earlier push failed")
+        with stage("push"):
+            commit_sha = checkpoint(f"commit.{i}", lambda: push_files_to_pages(repo_name, files, 2))
+        commits[i - 1] = commit_sha
+        with stage("evaluation"):
+            checkpoint(f"callback.{i}", lambda: post_evaluation(data, repo_name, commit_sha))
+        log(f"✅ Completed Round 2.{i} | Commit SHA: {commit_sha}")
+
+    # Fetch index.html once; after that each subround's output is the current code.
+    # Every step is checkpointed, a job resumed after a restart skips the ones already done
+    current_code = checkpoint("fetch_code", fetch_code) if ROUND2_MODE == "patch" else None
+
+    # The next subround only needs this one's code, not its commit: pushes
+    # run behind the LLM calls instead of between them
+    pushes = []
+    with ThreadPoolExecutor(max_workers=1) as pusher:
+        for i, subround in enumerate(subrounds, start=1):
+            if pushes and pushes[-1].done():
+                # Don't spend LLM calls on a round that already failed
+                pushes[-1].result()
+            log(f"--- Starting Round 2.{i} ---")
+
+            if subround.get("attachments", []):
+                with stage("parse_attachments"):
+                    attachfiles = parse_attachments(subround)
+            else:
+                attachfiles = []
 
-        It must pass the following checks:
-        {checks_text}
+            extra_files = attachment_files(attachfiles)
+            files = checkpoint(f"files.{i}", functools.partial(generate, subround, attachfiles, extra_files,
+                                                                current_code))
+            current_code = files[0]["content"]
+            files = files + extra_files
 
-        Include only code (no markdown or explanation).
-        The updated app must remain inside a single file: index.html.
-        """
+            pushes.append(pusher.submit(bind_job(publish), i, files, pushes[-1] if pushes else None))
 
-        # Generate the updated HTML with LLM
-        files = write_code_with_llm(prompt)
+        for push in pushes:
+            push.result()
 
-        # Encode files to base64 before pushing
+    result = repo_result(repo_name, commits[-1] if commits else None)
+    result["commits"] = commits
+    return result
 
-        # Push changes to GitHub (Round 2 update mode)
-        commit_sha = push_files_to_pages(repo_name, files, 2)
+def fold_subrounds(subrounds: list[dict]) -> dict:
+    """
+    Merge round-2 subrounds into one, for callers that only need the final state.
+    """
+    briefs = "\n".join(f"{i}. {s['brief']}" for i, s in enumerate(subrounds, start=1))
+    return {
+        "brief": f"Make all of these changes, in order:\n{briefs}",
+        "checks": [check for s in subrounds for check in s.get("checks", [])],
+        "attachments": [att for s in subrounds for att in s.get("attachments", [])],
+    }
 
-        # Post evaluation for this sub-round
-        post_evaluation(data, repo_name, commit_sha)
 
-        print(f"✅ Completed Round 2.{i} | Commit SHA: {commit_sha}")
-    
 
 
+def repo_result(repo_name: str, commit_sha: str) -> dict:
+    return {
+        "repo_url": f"https://github.com/23f2000524/{repo_name}",
+        "pages_url": f"https://23f2000524.github.io/{repo_name}/",
+        "commit_sha": commit_sha,
+    }
 
 
 def create_repo(name: str):
@@ -159,133 +300,482 @@ def create_repo(name: str):
               "private": False,
               "auto_init": False,
               "license_template": "mit"}
-    header={"Authorization": f"Bearer {GITHUB_TOKEN}",
-                 "Accept": "application/vnd.github.v3+json"}
-    response = requests.post(
-        "https://api.github.com/user/repos",
-        headers=header,
+    response = github.post(
+        f"{GITHUB_API}/user/repos",
         json=payload
               )
+    if response.status_code == 422 and "already exists" in response.text:
+        # Retried task: the repo was created by an earlier attempt
+        log(f"Repo {name} already exists")
+        return None
     if response.status_code != 201:
-        return Exception(f"Failed to create repo : {response.status_code}, {response.text}")
+        raise Exception(f"Failed to create repo : {response.status_code}, {response.text}")
     else:
         return response.json()
 
 def enable_pages(repo_name: str):
-    headers={
-        "Authorization": f"Bearer {GITHUB_TOKEN}",
-        "Accept": "application/vnd.github.v3+json"
-        }
     payload={
         "source":{
             "branch":"main",
             "path":"/"
             },
         "build_type":"legacy"}
-    response = requests.post(
-        f"https://api.github.com/repos/23f2000524/{repo_name}/pages",
-        headers=headers,
+    response = github.post(
+        f"{GITHUB_API}/repos/23f2000524/{repo_name}/pages",
         json=payload
               )
+    if response.status_code == 409:
+        # Pages is already enabled for this repo
+        return None
     if response.status_code != 201:
-        return Exception(f"Failed to enable pages : {response.status_code}, {response.text}")
+        raise Exception(f"Failed to enable pages : {response.status_code}, {response.text}")
     else:     
         return response.json()
     
 
+def rename_repo(repo_name: str, new_name: str) -> int:
+    response = github.patch(f"{GITHUB_API}/repos/23f2000524/{repo_name}", json={"name": new_name})
+    if response.status_code not in (200, 404, 422):
+        raise Exception(f"Failed to rename repo : {response.status_code}, {response.text}")
+    return response.status_code
+
+def delete_repo(repo_name: str):
+    response = github.request("DELETE", f"{GITHUB_API}/repos/23f2000524/{repo_name}")
+    if response.status_code not in (204, 404):
+        raise Exception(f"Failed to delete repo : {response.status_code}, {response.text}")
+
+def get_pages_build(repo_name: str):
+    """
+    Latest Pages build ({"status": ..., "commit": ...}), or None before the first one.
+    """
+    response = github.get(f"{GITHUB_API}/repos/23f2000524/{repo_name}/pages/builds/latest")
+    if response.status_code == 404:
+        return None
+    if response.status_code != 200:
+        raise Exception(f"Failed to get pages build : {response.status_code}, {response.text}")
+    return response.json()
+
 def get_sha_of_latest_commit(repo_name: str, branch: str="main") -> str:
-    headers={
-        "Authorization": f"Bearer {GITHUB_TOKEN}",
-        "Accept": "application/vnd.github.v3+json"
-        }
-    response = requests.get(
-        f"https://api.github.com/repos/23f2000524/{repo_name}/git/refs/heads/{branch}",
-        headers=headers
+    response = github.get(
+        f"{GITHUB_API}/repos/23f2000524/{repo_name}/git/refs/heads/{branch}"
               )
     if response.status_code != 200:
-        return Exception(f"Failed to get file sha : {response.status_code}, {response.text}")
+        raise Exception(f"Failed to get latest commit sha : {response.status_code}, {response.text}")
     else:
         return response.json()["object"]["sha"]
     
 def get_file_sha(repo_name: str, file_path: str, branch: str = "main") -> str:
-    headers = {
-        "Authorization": f"Bearer {GITHUB_TOKEN}",
-        "Accept": "application/vnd.github.v3+json"
-    }
-    resp = requests.get(
-        f"https://api.github.com/repos/23f2000524/{repo_name}/contents/{file_path}?ref={branch}",
-        headers=headers
+    resp = github.get(
+        f"{GITHUB_API}/repos/23f2000524/{repo_name}/contents/{file_path}?ref={branch}"
     )
+    if resp.status_code == 404:
+        # New file, nothing to replace
+        return None
     if resp.status_code != 200:
         raise Exception(f"Failed to get file sha for {file_path} : {resp.status_code}, {resp.text}")
     return resp.json()["sha"]
 
 
+def get_file_content(repo_name: str, file_path: str, branch: str = "main") -> str:
+    resp = github.get(
+        f"{GITHUB_API}/repos/23f2000524/{repo_name}/contents/{file_path}?ref={branch}",
+        headers={"Accept": "application/vnd.github.raw+json"}
+    )
+    if resp.status_code != 200:
+        raise Exception(f"Failed to get {file_path} : {resp.status_code}, {resp.text}")
+    return resp.text
+
+
 def push_files_to_pages(repo_name: str,files:list[dict],round:int):
-    if round == 2:
-        latest_sha = get_sha_of_latest_commit(repo_name)
+    if PUSH_MODE == "commit":
+        return push_files_as_commit(repo_name, files, round)
+    return push_files_with_contents_api(repo_name, files, round)
+
+
+def push_files_as_commit(repo_name: str, files: list[dict], round: int, branch: str = "main") -> str:
+    """
+    Push all files as a single commit using the Git Data API:
+    ref -> base commit -> tree -> commit -> ref update.
+    Text files are inlined in the tree, binary files are uploaded as blobs
+    concurrently, so the number of sequential calls doesn't grow with files.
+    The ref and base tree come from repo_state when this process pushed last;
+    if the ref moved in the meantime the update is redone from the API.
+    """
+    repo_api = f"{GITHUB_API}/repos/23f2000524/{repo_name}"
+
+    def create_blob(file):
+        content = file.get("content")
+        if isinstance(content, bytes):
+            content = base64.b64encode(content).decode("utf-8")
+        resp = github.post(
+            f"{repo_api}/git/blobs",
+            json={"content": content, "encoding": "base64"}
+        )
+        if resp.status_code != 201:
+            raise Exception(f"Failed to create blob for {file.get('name')} : {resp.status_code}, {resp.text}")
+        return resp.json()["sha"]
+
+    def read_head():
+        with stage("sha_lookup"):
+            response = github.get(f"{repo_api}/git/ref/heads/{branch}")
+        if response.status_code != 200:
+            return None
+        parent_sha = response.json()["object"]["sha"]
+        with stage("sha_lookup"):
+            response = github.get(f"{repo_api}/git/commits/{parent_sha}")
+        if response.status_code != 200:
+            raise Exception(f"Failed to get commit {parent_sha} : {response.status_code}, {response.text}")
+        return parent_sha, response.json()["tree"]["sha"]
+
+    def read_tree_blobs(tree_sha):
+        with stage("sha_lookup"):
+            response = github.get(f"{repo_api}/git/trees/{tree_sha}")
+        if response.status_code != 200:
+            return {}
+        return {e["path"]: e["sha"] for e in response.json().get("tree", []) if e.get("type") == "blob"}
+
+    state = repo_state.get(repo_name)
+    cached = state is not None and state["head"] is not None and state["tree"] is not None
+    if cached:
+        parent_sha, base_tree = state["head"], state["tree"]
+        remote_blobs = state["blobs"]
+    else:
+        head = read_head()
+        if head is None:
+            # Empty repo (no initial commit): the Git Data API can't be used yet
+            return push_files_with_contents_api(repo_name, files, round)
+        parent_sha, base_tree = head
+        # A fresh round-1 repo only has the LICENSE, no point listing it
+        remote_blobs = read_tree_blobs(base_tree) if round == 2 else {}
+
+    # Skip files whose content is already on the branch; only hash files the branch has
+    files = [f for f in files
+             if f["name"] not in remote_blobs or remote_blobs[f["name"]] != git_blob_sha(attachment_bytes(f))]
+    if not files:
+        log(f"No changes to push to {repo_name}, keeping {parent_sha}")
+        repo_state.record(repo_name, parent_sha, base_tree, remote_blobs)
+        return parent_sha
+
+    tree = []
+    binaries = []
+    for file in files:
+        content = file.get("content")
+        if file.get("binary", False) or isinstance(content, bytes):
+            binaries.append(file)
+        else:
+            tree.append({"path": file["name"], "mode": "100644", "type": "blob", "content": content})
+    if binaries:
+        with ThreadPoolExecutor(max_workers=min(len(binaries), 8)) as pool:
+            for file, sha in zip(binaries, pool.map(create_blob, binaries)):
+                tree.append({"path": file["name"], "mode": "100644", "type": "blob", "sha": sha})
+    names = ", ".join(f["name"] for f in files)
+
+    while True:
+        response = github.post(f"{repo_api}/git/trees", json={"base_tree": base_tree, "tree": tree})
+        if response.status_code != 201:
+            raise Exception(f"Failed to create tree : {response.status_code}, {response.text}")
+        tree_sha = response.json()["sha"]
+        pushed = {f["name"] for f in files}
+        blobs = {e["path"]: e["sha"] for e in response.json().get("tree", []) if e.get("path") in pushed}
+
+        payload = {
+            "message": f"Update {names}" if round == 2 else f"Add {names}",
+            "tree": tree_sha,
+            "parents": [parent_sha],
+        }
+        response = github.post(f"{repo_api}/git/commits", json=payload)
+        if response.status_code != 201:
+            raise Exception(f"Failed to create commit : {response.status_code}, {response.text}")
+        commit_sha = response.json()["sha"]
+
+        response = github.patch(f"{repo_api}/git/refs/heads/{branch}", json={"sha": commit_sha})
+        if response.status_code in (409, 422) and cached:
+            # Not a fast-forward: someone else moved the branch, redo from the real head
+            log(f"Cached head of {repo_name} is stale, re-reading {branch}")
+            repo_state.invalidate(repo_name)
+            cached = False
+            head = read_head()
+            if head is None:
+                raise Exception(f"Failed to get {branch} of {repo_name}")
+            parent_sha, base_tree = head
+            continue
+        if response.status_code != 200:
+            raise Exception(f"Failed to update {branch} : {response.status_code}, {response.text}")
+        repo_state.record(repo_name, commit_sha, tree_sha, blobs)
+        return commit_sha
+
+
+def push_files_with_contents_api(repo_name: str,files:list[dict],round:int):
+    state = repo_state.get(repo_name) or {"head": None, "tree": None, "blobs": {}}
+    if round == 2 and not state["head"]:
+        with stage("sha_lookup"):
+            latest_sha = get_sha_of_latest_commit(repo_name)
     else:
-        latest_sha = None
+        latest_sha = state["head"]
 
-    commit_sha = None
+    # With nothing to push, the current head is the commit to report
+    commit_sha = latest_sha
     for file in files:
         file_name=file.get("name")
-        file_content=file.get("content")
-        binary=file.get("binary", False)
-        if not isinstance(file_content, bytes):
-            if binary:
-                # base64 string -> bytes
-                file_content = base64.b64decode(file_content)
-            else:
-                file_content = file_content.encode("utf-8")
-        b64_content = base64.b64encode(file_content).decode("utf-8")
-        headers={
-            "Authorization": f"Bearer {GITHUB_TOKEN}",
-            "Accept": "application/vnd.github.v3+json"
-            }
+        sha = state["blobs"].get(file_name)
+        if sha is None and round == 2:
+            with stage("sha_lookup"):
+                sha = get_file_sha(repo_name, file_name)
+        if sha is not None and sha == git_blob_sha(attachment_bytes(file)):
+            log(f"{file_name} unchanged, not pushing it")
+            continue
+
+        if file.get("binary", False) and isinstance(file.get("content"), str):
+            # Already base64, send it as is
+            b64_content = file["content"]
+        else:
+            b64_content = base64.b64encode(attachment_bytes(file)).decode("utf-8")
         payload={
             "message": f"Update {file_name}" if latest_sha else f"Add {file_name}",
             "content": b64_content
                 }
         
 
-        sha = get_file_sha(repo_name, file_name) if round == 2 else None
         if sha :
             payload["sha"] = sha
-        response = requests.put(
-            f"https://api.github.com/repos/23f2000524/{repo_name}/contents/{file_name}",
-            headers=headers,
-            json=payload
-                  )
+        with stage("push_file"):
+            response = github.put(
+                f"{GITHUB_API}/repos/23f2000524/{repo_name}/contents/{file_name}",
+                json=payload
+                      )
+        if response.status_code in (409, 422) and file_name in state["blobs"]:
+            # Cached blob SHA is out of date, look it up and try once more
+            repo_state.invalidate(repo_name)
+            state["blobs"].clear()
+            with stage("sha_lookup"):
+                payload["sha"] = get_file_sha(repo_name, file_name)
+            with stage("push_file"):
+                response = github.put(
+                    f"{GITHUB_API}/repos/23f2000524/{repo_name}/contents/{file_name}",
+                    json=payload
+                          )
         if response.status_code not in [200,201]:
             raise Exception(f"Failed to push file {file_name} : {response.status_code}, {response.text}")
-        commit_sha = response.json()["commit"]["sha"]
+        body = response.json()
+        commit_sha = body["commit"]["sha"]
+        latest_sha = commit_sha
+        repo_state.record(repo_name, commit_sha, (body["commit"].get("tree") or {}).get("sha"),
+                          {file_name: (body.get("content") or {}).get("sha")})
     return commit_sha
 
-def write_code_with_llm(prompt: str):
-    API_URL = "https://aipipe.org/openai/v1/chat/completions"
-    API_KEY = os.getenv("AIAPI_KEY")
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {API_KEY}"
-    }
+def ask_llm(prompt: str, max_tokens: int = LLM_MAX_TOKENS, use_cache: bool = True, validate=None,
+            kind: str = "write", candidate: int = 0, cancel=None, cache_if=None) -> str:
+    """
+    validate(partial_text) is run on the start of the streamed reply and returns
+    an error string to cancel and retry the generation, or None to keep going.
+    The last attempt is never cancelled. kind ("write" or "edit") feeds model routing.
+    candidate > 0 asks for another sample of the same prompt (cached separately);
+    setting the cancel event stops the call with CancelledError. A fresh reply is
+    only cached if use_cache is set and cache_if(reply), when given, is true; the
+    last attempt isn't validated, so callers pass a check of the whole reply.
+    """
     data = {
-        "model": "gpt-4o",
+        "model": llm_router.choose(count_tokens(prompt), kind),
         "messages": [{"role": "user", "content": prompt}],
-        "max_tokens": 1000,
-        "temperature": 0.7
+        "max_tokens": max_tokens,
+        "temperature": 0.7,
+        "stream": True,
+        "stream_options": {"include_usage": True}
     }
+    if candidate:
+        data["seed"] = candidate
 
-    resp = requests.post(API_URL, headers=headers, json=data)
-    if resp.status_code != 200:
-        raise Exception(f"LLM API error: {resp.status_code} - {resp.text}")
-
-    code = resp.json()["choices"][0]["message"]["content"].strip()
+    key = cache_key(data)
+    cached = llm_cache.get(key) if use_cache else None
+    if cached is not None:
+        code = cached["content"]
+    else:
+        if not use_cache:
+            llm_cache.record_bypass()
+        start = time.perf_counter()
+        for attempt in range(LLM_STREAM_RETRIES + 1):
+            last = attempt == LLM_STREAM_RETRIES
+            completion = functools.partial(stream_completion, data, None if last else validate, attempt)
+            code, usage, error = llm_router.call(completion, data["model"], cancel=cancel, kind=kind,
+                                                 max_tokens=max_tokens)
+            if error is None:
+                break
+            log(f"Cancelled LLM stream (attempt {attempt + 1}): {error}")
+        code = code.strip()
+        if use_cache and (cache_if is None or cache_if(code)):
+            llm_cache.put(key, code, usage, time.perf_counter() - start)
+    return code
+
+def stream_completion(data: dict, validate=None, attempt: int = 0, call=None):
+    """
+    Read a chat-completions SSE stream. Returns (text, usage, error); error is set
+    when validate rejected the partial output and the stream was closed early.
+    call is the router's handle, used to stop reading when the request is cancelled.
+    """
+    start = time.perf_counter()
+    resp = llm.post(LLM_API_URL, json=data, stream=True, retry=attempt)
+    if call is not None:
+        call.response = resp
+    try:
+        if resp.status_code != 200:
+            raise Exception(f"LLM API error: {resp.status_code} - {resp.text}")
+
+        text = ""
+        usage = {}
+        first_token = None
+        checked = 0
+        for line in resp.iter_lines(decode_unicode=True):
+            if call is not None and call.cancelled.is_set():
+                return text, usage, "cancelled"
+            if not line or not line.startswith("data:"):
+                continue
+            chunk = line[5:].strip()
+            if chunk == "[DONE]":
+                break
+            event = json.loads(chunk)
+            usage = event.get("usage") or usage
+            for choice in event.get("choices", []):
+                delta = (choice.get("delta") or {}).get("content")
+                if not delta:
+                    continue
+                if first_token is None:
+                    first_token = time.perf_counter() - start
+                    metrics.llm_ttft_seconds.observe(first_token, model=data["model"])
+                text += delta
+            # Only the start of the reply tells us whether it's the wrong shape
+            if validate is not None and text and checked < STREAM_VALIDATE_CHARS:
+                checked = len(text)
+                error = validate(text)
+                if error:
+                    metrics.llm_streams_cancelled_total.inc(model=data["model"], reason=error)
+                    return text, usage, error
+        elapsed = time.perf_counter() - start
+        metrics.llm_stream_seconds.observe(elapsed, model=data["model"])
+        log(f"LLM stream done: ttft={first_token or 0:.2f}s total={elapsed:.2f}s")
+        return text, usage, None
+    finally:
+        resp.close()
+
+def write_code_with_llm(prompt: str, brief: str, use_cache: bool = True, max_tokens: int = LLM_MAX_TOKENS,
+                        candidate: int = 0, cancel=None, cache_if=None):
+    # Only whole pages are cached; cache_if, if given, is also called with the page's HTML
+    def cache_page(reply):
+        page = strip_fences(reply)
+        return looks_like_html(page) and (cache_if is None or cache_if(page))
+
+    code = strip_fences(ask_llm(prompt, max_tokens=max_tokens, use_cache=use_cache,
+                                validate=html_stream_error, candidate=candidate, cancel=cancel,
+                                cache_if=cache_page))
+    return make_files(brief, code)
+
+def write_checked_code(prompt: str, brief: str, checks: list[str], extra_files: list[dict] = (),
+                       use_cache: bool = True, max_tokens: int = LLM_MAX_TOKENS):
+    """
+    write_code_with_llm, speculatively: LLM_CANDIDATES generations run in parallel
+    and each is checked locally against the task's checks as it arrives. The first
+    to pass them all is returned and the rest are cancelled; if none passes, the
+    one passing the most checks is. A failed push, Pages build and evaluation
+    costs far more than the extra samples. Only candidates that pass are cached,
+    so a repeated prompt doesn't get a failing sample back.
+    """
+    if LLM_CANDIDATES <= 1 or not checks or not local_checker.enabled():
+        return write_code_with_llm(prompt, brief, use_cache=use_cache, max_tokens=max_tokens)
+
+    cancel = threading.Event()
+
+    def candidate(i):
+        reports = []
+
+        def check(html):
+            with stage("local_checks"):
+                reports.append(local_checker.run(html, checks, extra_files))
+            return reports[-1] is not None and reports[-1]["passed"]
+
+        files = write_code_with_llm(prompt, brief, use_cache=use_cache, max_tokens=max_tokens,
+                                    candidate=i, cancel=cancel, cache_if=check)
+        if cancel.is_set():
+            raise CancelledError()
+        if not reports:
+            # Served from the cache, so it passed when cached; the report is still needed
+            check(files[0]["content"])
+        return files, reports[-1]
+
+    best, best_report, error = None, None, None
+    with ThreadPoolExecutor(max_workers=LLM_CANDIDATES) as pool:
+        futures = {pool.submit(bind_job(candidate), i): i for i in range(LLM_CANDIDATES)}
+        try:
+            for future in as_completed(futures):
+                i = futures[future]
+                try:
+                    files, report = future.result()
+                except CancelledError:
+                    continue
+                except Exception as e:
+                    log(f"Candidate {i} failed: {type(e).__name__}: {e}")
+                    metrics.llm_candidates_total.inc(outcome="error")
+                    error = error or e
+                    continue
+                if report is None:
+                    # The checker went away mid-run, take what we have
+                    report = {"passed": True, "counts": {}}
+                counts = report["counts"]
+                log(f"Candidate {i} local checks: {counts}")
+                if report["passed"]:
+                    metrics.llm_candidates_total.inc(outcome="passed")
+                    best, best_report = files, report
+                    break
+                metrics.llm_candidates_total.inc(outcome="failed")
+                if best is None or counts["pass"] > best_report["counts"]["pass"]:
+                    best, best_report = files, report
+        finally:
+            cancel.set()
+    cancelled = sum(1 for future in futures if isinstance(future.exception(), CancelledError))
+    if cancelled:
+        metrics.llm_candidates_total.inc(cancelled, outcome="cancelled")
+    if best is None:
+        raise error
+    job = current_job()
+    if job is not None:
+        job["local_checks"] = {"candidates": LLM_CANDIDATES, "passed": best_report["passed"],
+                               "counts": best_report["counts"],
+                               "failed": [r for r in best_report.get("results", []) if r["status"] in ("fail", "error")]}
+    if not best_report["passed"]:
+        log(f"No candidate passed every local check, pushing the best: {best_report['counts']}")
+    return best
+
+def edit_code_with_llm(prompt: str, brief: str, current_code: str, use_cache: bool = True):
+    """
+    Ask for SEARCH/REPLACE edits and apply them to current_code.
+    Returns the files to push, or None if the edits don't apply or break the page.
+    """
+    reply = ask_llm(prompt, use_cache=use_cache, validate=edit_stream_error, kind="edit",
+                    cache_if=lambda text: bool(parse_edits(text)))
+    try:
+        code = apply_edits(current_code, parse_edits(reply))
+    except ValueError as e:
+        log(f"Rejected LLM edit: {e}")
+        return None
+    if code == current_code or not looks_like_html(code):
+        log("Rejected LLM edit: no change or not a complete HTML document")
+        return None
+    return make_files(brief, code)
+
+def full_rewrite_max_tokens(current_code: str = None) -> int:
+    # ~4 chars per token, with room for the file to grow
+    if not current_code:
+        return LLM_MAX_TOKENS
+    return min(16000, max(LLM_MAX_TOKENS, len(current_code) * 3 // 8))
+
+def make_files(brief: str, code: str) -> list[dict]:
+    # README carries the brief only; the code is in index.html and attachments sit next to it
     return [
         {"name": "index.html", "content": code},
-        {"name": "README.md", "content": f"# Generated App\n\n## Latest Code Generated based on :\n{prompt}\n\n---\n\n## Generated Code\n\n{code}"}    ]
+        {"name": "README.md", "content": f"# Generated App\n\n## Brief\n\n{brief}\n\nThe app is in `index.html`.\n"}]
 
 def post_evaluation(data, repo_name, commit_sha):
+    """
+    Queue the evaluation callback; the outbox delivers and retries it in the background.
+    """
     payload = {
         "email": data["email"],
         "task": data["task"],
@@ -295,33 +785,124 @@ def post_evaluation(data, repo_name, commit_sha):
         "commit_sha": commit_sha,  # optional: fetch via API
         "pages_url": f"https://23f2000524.github.io/{repo_name}/"
     }
-    print(payload)
-    headers = {"Content-Type": "application/json"}
-    r = requests.post(data["evaluation_url"], headers=headers, json=payload)
-    if r.status_code != 200:
-        raise Exception(f"Eval post failed: {r.status_code} - {r.text}")
-    return True
+    job = current_job()
+    if job is not None:
+        # A resumed job may have queued this one just before the restart
+        for delivery in outbox.deliveries(job["id"]):
+            if delivery["commit_sha"] == commit_sha:
+                log(f"Evaluation for {commit_sha} already queued ({delivery['status']})")
+                return delivery["id"]
+    log(f"Queueing evaluation: {payload}")
+    # Held until Pages serves this commit, so the evaluator doesn't fetch a stale page
+    hold = PAGES_WAIT and commit_sha is not None
+    callback_id = outbox.enqueue(job["id"] if job is not None else None, data["evaluation_url"], payload, hold=hold)
+    if hold:
+        pages_tracker.watch(repo_name, commit_sha, lambda: outbox.release(callback_id))
+    return callback_id
 
 
 
 app = FastAPI()
+job_queue = JobQueue()
+repo_pool = RepoPool(bootstrap=bootstrap_repo, rename=rename_repo, delete=delete_repo)
+pages_tracker = PagesTracker(fetch_build=get_pages_build)
+
+
+def pipeline_for(data: dict):
+    return {1: round1, 2: round2}.get(data.get("round"))
+
+
+# Pick up the jobs a restart cut short, from their last checkpoint
+job_queue.resume(pipeline_for)
+
+
+def validate_task(data: dict):
+    """
+    Returns an error message if the task can't be run, else None.
+    """
+    missing = [k for k in ("email", "task", "nonce", "evaluation_url") if not data.get(k)]
+    if missing:
+        return f"Missing fields: {', '.join(missing)}"
+    if data.get("round") == 1 and not data.get("brief"):
+        return "Missing fields: brief"
+    if data.get("round") == 2 and not all(s.get("brief") for s in data.get("round2", [])):
+        return "Every round2 entry needs a brief"
+    for part in [data] + list(data.get("round2", []) if data.get("round") == 2 else []):
+        error = check_attachment_sizes(part)
+        if error:
+            return error
+    return None
+
 
 @app.post("/handle_task")
 def handle_task(data: dict):
     if not validate_secret(data.get("secret", "")):
         return {"error": "Incorrect secret"}
     else:
-
-        if data.get("round") == 1:
-            round1(data)
-            return {"message": "Round 1 started"}
-        elif data.get("round") == 2:
-            round2(data)
-            return {"message": "Round 2 started"}
-        else:
+        pipeline = pipeline_for(data)
+        if pipeline is None:
             return {"error": "Invalid round"}
-    print(data)
-    return {"message": "Task recieved", "data": data}
+        error = validate_task(data)
+        if error:
+            return JSONResponse(status_code=400, content={"error": error})
+        try:
+            job, created = job_queue.submit(pipeline, data)
+        except QueueFull as e:
+            # Shed load early rather than queue work that would wait past its usefulness;
+            # while GitHub is rate limited nothing drains before the pause ends either
+            retry_after = max(e.retry_after, min(int(github.paused_until - time.time()) + 1, MAX_RETRY_AFTER))
+            return JSONResponse(status_code=429, headers={"Retry-After": str(retry_after)},
+                                content={"error": str(e), "retry_after": retry_after})
+        if created:
+            message = f"Round {data['round']} started"
+        elif job["status"] == "done":
+            return {"message": f"Round {data['round']} already completed",
+                    "job_id": job["id"], "result": job["result"]}
+        else:
+            message = f"Round {data['round']} already in progress"
+        return JSONResponse(
+            status_code=202,
+            content={"message": message, "job_id": job["id"]},
+        )
+
+
+@app.get("/jobs/{job_id}")
+def get_job(job_id: str):
+    job = job_queue.get(job_id)
+    if job is None:
+        return JSONResponse(status_code=404, content={"error": "Unknown job"})
+    job["callbacks"] = outbox.deliveries(job_id)
+    return job
+
+
+@app.get("/llm_cache")
+def get_llm_cache_stats():
+    return llm_cache.stats()
+
+
+@app.get("/queue")
+def get_queue_stats():
+    return job_queue.stats()
+
+
+@app.get("/repo_pool")
+def get_repo_pool_stats():
+    return repo_pool.stats()
+
+
+@app.get("/pages")
+def get_pages_stats():
+    return pages_tracker.stats()
+
+
+@app.get("/llm_models")
+def get_llm_model_stats():
+    return llm_router.snapshot()
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def get_metrics():
+    return metrics.render()
 
 
 @app.get("/")
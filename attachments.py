@@ -0,0 +1,224 @@
+import os
+import re
+import base64
+import codecs
+import struct
+from urllib.parse import unquote
+
+ATTACHMENT_MAX_BYTES = int(os.getenv("ATTACHMENT_MAX_BYTES", str(10 * 1024 * 1024)))
+REQUEST_ATTACHMENTS_MAX_BYTES = int(os.getenv("REQUEST_ATTACHMENTS_MAX_BYTES", str(25 * 1024 * 1024)))
+# base64 characters decoded per step, a multiple of 4
+DECODE_CHUNK = 64 * 1024
+
+TEXT_MIME_TYPES = ("application/json", "application/xml", "application/javascript",
+                   "application/x-javascript", "application/csv", "image/svg+xml")
+_WHITESPACE = re.compile(r"\s+")
+
+
+def decoded_size(b64_len: int) -> int:
+    return b64_len * 3 // 4
+
+
+def split_data_uri(url: str):
+    """
+    Returns (mime, is_base64, start) where url[start:] is the payload,
+    without copying the payload.
+    """
+    comma = url.find(",")
+    if comma == -1:
+        raise ValueError("missing ',' in data URI")
+    header = url[5:comma]
+    params = header.split(";")
+    mime = params[0].strip().lower() or "text/plain"
+    return mime, "base64" in params[1:], comma + 1
+
+
+def is_text_mime(mime: str):
+    """
+    True/False when the MIME type decides it, None when the bytes must be sniffed.
+    """
+    if mime.startswith("text/") or mime in TEXT_MIME_TYPES or mime.endswith(("+json", "+xml")):
+        return True
+    if mime in ("", "application/octet-stream"):
+        return None
+    return False
+
+
+def clean_b64(b64: str) -> str:
+    # Only copy when the payload actually needs whitespace removed or padding added
+    if _WHITESPACE.search(b64):
+        b64 = _WHITESPACE.sub("", b64)
+    missing_padding = len(b64) % 4
+    if missing_padding:
+        b64 += "=" * (4 - missing_padding)
+    return b64
+
+
+def sniff_text(b64: str) -> bool:
+    head = base64.b64decode(b64[:DECODE_CHUNK])
+    try:
+        codecs.getincrementaldecoder("utf-8")().decode(head, final=False)
+        return True
+    except UnicodeDecodeError:
+        return False
+
+
+def decode_text(name: str, b64: str) -> dict:
+    """
+    Decode a base64 text payload chunk by chunk, so the decoded bytes are never
+    held whole next to the text. The text itself stays in memory: the prompt,
+    the push and the local checks all need it, so a task's memory still grows
+    with its attachments (up to REQUEST_ATTACHMENTS_MAX_BYTES).
+    Raises UnicodeDecodeError if the bytes turn out not to be UTF-8.
+    """
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    parts = []
+    size = 0
+    for i in range(0, len(b64), DECODE_CHUNK):
+        raw = base64.b64decode(b64[i:i + DECODE_CHUNK])
+        size += len(raw)
+        parts.append(decoder.decode(raw, final=i + DECODE_CHUNK >= len(b64)))
+    return {"name": name, "content": "".join(parts), "binary": False, "size": size}
+
+
+def parse_attachments(data: dict)-> list[dict]:
+    """
+    Parse attachments array and decode data: URIs into file objects:
+    returns list of {"name": ..., "content": "...", "binary": bool, "mime": ..., "size": bytes}
+    Binary payloads keep their base64 text as content (no decode/re-encode).
+    """
+    files = []
+    total = 0
+    for att in data.get("attachments", []):
+        name = att.get("name")
+        url = att.get("url", "")
+        if not name or not url:
+            continue
+        if url.startswith("data:"):
+            try:
+                mime, is_b64, start = split_data_uri(url)
+                size = decoded_size(len(url) - start) if is_b64 else len(url) - start
+                if size > ATTACHMENT_MAX_BYTES:
+                    raise ValueError(f"larger than {ATTACHMENT_MAX_BYTES} bytes")
+                total += size
+                if total > REQUEST_ATTACHMENTS_MAX_BYTES:
+                    raise ValueError(f"attachments exceed {REQUEST_ATTACHMENTS_MAX_BYTES} bytes in total")
+                if not is_b64:
+                    text = unquote(url[start:])
+                    files.append({"name": name, "content": text, "binary": False, "mime": mime,
+                                  "size": len(text.encode("utf-8"))})
+                    continue
+                b64 = clean_b64(url[start:])
+                text = is_text_mime(mime)
+                if text is None:
+                    text = sniff_text(b64)
+                if text:
+                    try:
+                        file = decode_text(name, b64)
+                    except UnicodeDecodeError:
+                        text = False
+                    else:
+                        file["mime"] = mime
+                        files.append(file)
+                if not text:
+                    files.append({"name": name, "content": b64, "binary": True, "mime": mime,
+                                  "size": decoded_size(len(b64)) - b64.count("=", -2)})
+            except Exception as e:
+                raise ValueError(f"Invalid data URI for attachment {name}: {e}")
+        else:
+            # non-data URIs are not fetched for security/simplicity; treat as placeholder
+            raise ValueError("Only data: attachments are supported by this service.")
+    return files
+
+
+def check_attachment_sizes(data: dict):
+    """
+    Cheap size check on the raw payload so oversized tasks are refused
+    before they're queued. Returns an error message or None.
+    """
+    total = 0
+    for att in data.get("attachments", []) or []:
+        url = att.get("url", "") or ""
+        size = decoded_size(len(url))
+        if size > ATTACHMENT_MAX_BYTES:
+            return f"Attachment {att.get('name')} is larger than {ATTACHMENT_MAX_BYTES} bytes"
+        total += size
+    if total > REQUEST_ATTACHMENTS_MAX_BYTES:
+        return f"Attachments exceed {REQUEST_ATTACHMENTS_MAX_BYTES} bytes in total"
+    return None
+
+
+def attachment_bytes(file: dict) -> bytes:
+    content = file.get("content")
+    if isinstance(content, bytes):
+        return content
+    if file.get("binary", False):
+        # base64 string -> bytes
+        return base64.b64decode(content)
+    return content.encode("utf-8")
+
+
+def image_dimensions(file: dict):
+    """
+    (width, height) read from the header of a PNG, GIF, JPEG, WebP or BMP
+    attachment, or None. Only the start of the base64 payload is decoded.
+    """
+    content = file.get("content")
+    if not file.get("binary", False) or not isinstance(content, str):
+        return None
+    head = base64.b64decode(content[:DECODE_CHUNK])
+    if head[:8] == b"\x89PNG\r\n\x1a\n" and len(head) >= 24:
+        return struct.unpack(">II", head[16:24])
+    if head[:6] in (b"GIF87a", b"GIF89a") and len(head) >= 10:
+        return struct.unpack("<HH", head[6:10])
+    if head[:2] == b"BM" and len(head) >= 26:
+        width, height = struct.unpack("<ii", head[18:26])
+        return width, abs(height)
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP" and len(head) >= 30:
+        chunk = head[12:16]
+        if chunk == b"VP8 ":
+            width, height = struct.unpack("<HH", head[26:30])
+            return width & 0x3FFF, height & 0x3FFF
+        if chunk == b"VP8L":
+            bits = int.from_bytes(head[21:25], "little")
+            return (bits & 0x3FFF) + 1, ((bits >> 14) & 0x3FFF) + 1
+        if chunk == b"VP8X":
+            return int.from_bytes(head[24:27], "little") + 1, int.from_bytes(head[27:30], "little") + 1
+        return None
+    if head[:2] == b"\xff\xd8":
+        # Walk JPEG segments to the first start-of-frame marker
+        i = 2
+        while i + 9 < len(head):
+            if head[i] != 0xFF:
+                i += 1
+                continue
+            marker = head[i + 1]
+            if marker in (0xD8, 0x01) or 0xD0 <= marker <= 0xD7:
+                i += 2
+                continue
+            length = struct.unpack(">H", head[i + 2:i + 4])[0]
+            if 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+                height, width = struct.unpack(">HH", head[i + 5:i + 9])
+                return width, height
+            i += 2 + length
+    return None
+
+
+def describe_attachment(file: dict) -> str:
+    """
+    One-line description of a binary attachment for the prompt, in place of its bytes.
+    """
+    parts = [file.get("mime") or "application/octet-stream", f"{file.get('size', 0)} bytes"]
+    dimensions = image_dimensions(file)
+    if dimensions:
+        parts.append(f"{dimensions[0]}x{dimensions[1]} px")
+    return f"{file['name']} ({', '.join(parts)}), committed next to index.html, load it as ./{file['name']}"
+
+
+def repo_path(name: str) -> str:
+    """
+    Attachment name as a flat, safe path in the repo root.
+    """
+    name = name.replace("\\", "/").split("/")[-1].strip()
+    name = re.sub(r"[^A-Za-z0-9._-]", "_", name).lstrip(".")
+    return name or "attachment"
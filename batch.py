@@ -0,0 +1,196 @@
+# /// script
+# requires-python = ">=3.11"
+# dependencies = [
+#   "fastapi[standard]",
+#   "uvicorn",
+#   "requests",
+# ]
+# ///
+"""
+Run a JSONL file of /handle_task payloads through the round1/round2 pipeline
+without the HTTP server, one result line per task:
+
+    python batch.py tasks.jsonl --output results.jsonl --concurrency 16
+
+Tasks are read as they're needed, never the whole file at once. The output
+doubles as the checkpoint: rerunning the same command skips every input line
+that already has a result and appends the rest (--retry-failed also redoes
+failed ones).
+
+The batch keeps its jobs, callbacks and repo pool in its own database next to
+the output (<output>.jobs.db), never a server's jobs.db: on start the app
+resumes every unfinished job in its database, and its outbox sends every
+pending callback.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+
+# Per-upstream limits are read by the app's modules at import time
+LIMIT_ENV = {
+    "concurrency": "MAX_WORKERS",
+    "github_connections": "GITHUB_MAX_CONNECTIONS",
+    "github_writes": "GITHUB_MAX_CONCURRENT_WRITES",
+    "llm_connections": "LLM_MAX_CONNECTIONS",
+    "evaluation_per_host": "EVALUATION_MAX_PER_HOST",
+    "tenant_max_running": "TENANT_MAX_RUNNING",
+}
+
+
+def read_checkpoint(path: str, retry_failed: bool) -> dict:
+    """
+    {line number: (task, nonce, round)} of the input lines already handled.
+    A torn last line from an interrupted run is ignored.
+    """
+    done = {}
+    if not os.path.exists(path):
+        return done
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if retry_failed and record.get("status") != "done":
+                done.pop(record.get("line"), None)
+                continue
+            done[record.get("line")] = (record.get("task"), record.get("nonce"), record.get("round"))
+    return done
+
+
+def read_tasks(path: str):
+    """
+    Yields (line number, payload or None, error) for each non-blank line.
+    """
+    with open(path, encoding="utf-8") as f:
+        for number, line in enumerate(f, start=1):
+            if not line.strip():
+                continue
+            try:
+                data = json.loads(line)
+                if not isinstance(data, dict):
+                    raise ValueError("not a JSON object")
+                yield number, data, None
+            except ValueError as e:
+                yield number, None, f"Invalid JSON: {e}"
+
+
+def task_key(data: dict):
+    return (data.get("task"), data.get("nonce"), data.get("round"))
+
+
+def run(args) -> dict:
+    for option, env in LIMIT_ENV.items():
+        if getattr(args, option) is not None:
+            os.environ[env] = str(getattr(args, option))
+    # Not a server's database, or this process would resume its live jobs and send its callbacks
+    db_path = os.path.splitext(args.output)[0] + ".jobs.db"
+    for env in ("JOB_DB_PATH", "OUTBOX_DB_PATH", "REPO_POOL_DB_PATH"):
+        os.environ[env] = db_path
+    import app
+    import jobs
+    from fair_queue import QueueFull
+
+    done = read_checkpoint(args.output, args.retry_failed)
+    counts = {"done": 0, "failed": 0, "invalid": 0, "skipped": 0}
+    running = {}
+    submitted = set()
+    max_in_flight = jobs.MAX_WORKERS
+
+    with open(args.output, "a", encoding="utf-8") as out:
+
+        def write(number: int, data: dict, status: str, job: dict = None, error: str = None):
+            task, nonce, round_no = task_key(data or {})
+            record = {"line": number, "task": task, "nonce": nonce, "round": round_no, "status": status,
+                      "job_id": job["id"] if job else None,
+                      "result": job["result"] if job else None,
+                      "error": error if error is not None else (job["error"] if job else None),
+                      "timings": job["timings"] if job else None}
+            out.write(json.dumps(record, default=str) + "\n")
+            out.flush()
+            counts[status] += 1
+            if status != "done":
+                print(f"line {number}: {status}: {record['error']}", file=sys.stderr)
+
+        def collect(block: bool):
+            # Write out finished jobs; with block, wait until at least one slot frees up
+            while running:
+                for job_id, lines in list(running.items()):
+                    job = app.job_queue.get(job_id)
+                    if job and job["status"] in ("done", "failed"):
+                        del running[job_id]
+                        for number, data in lines:
+                            write(number, data, job["status"], job)
+                if not block or len(running) < max_in_flight:
+                    return
+                time.sleep(0.05)
+
+        for number, data, error in read_tasks(args.input):
+            if error is not None:
+                if number not in done:
+                    write(number, None, "invalid", error=error)
+                continue
+            if done.get(number) == task_key(data):
+                counts["skipped"] += 1
+                continue
+            pipeline = app.pipeline_for(data)
+            error = "Invalid round" if pipeline is None else app.validate_task(data)
+            if error:
+                write(number, data, "invalid", error=error)
+                continue
+            collect(block=len(running) >= max_in_flight)
+            # A repeated (task, nonce, round) attaches to the job already running or finished
+            while True:
+                try:
+                    job, _ = app.job_queue.submit(pipeline, data)
+                    break
+                except QueueFull as e:
+                    # Only with QUEUE_MAX_DEPTH or TENANT_MAX_QUEUED below --concurrency
+                    time.sleep(min(e.retry_after, 5))
+                    collect(block=False)
+            running.setdefault(job["id"], []).append((number, data))
+            submitted.add(job["id"])
+
+        while running:
+            collect(block=False)
+            time.sleep(0.05)
+
+    if args.wait_callbacks:
+        # Undelivered callbacks would otherwise wait for the next start of the app
+        while app.outbox.pending(submitted):
+            time.sleep(0.2)
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a JSONL file of tasks through the pipeline")
+    parser.add_argument("input", help="JSONL file, one /handle_task payload per line")
+    parser.add_argument("--output", help="results JSONL, also the resume checkpoint (default: <input>.results.jsonl)")
+    parser.add_argument("--concurrency", type=int, default=None, help="tasks run at once (MAX_WORKERS)")
+    parser.add_argument("--github-connections", type=int, default=None)
+    parser.add_argument("--github-writes", type=int, default=None, help="concurrent GitHub write calls")
+    parser.add_argument("--llm-connections", type=int, default=None)
+    parser.add_argument("--evaluation-per-host", type=int, default=None,
+                        help="evaluation callbacks in flight per host")
+    parser.add_argument("--tenant-max-running", type=int, default=None,
+                        help="tasks of one email run at once while other emails' tasks wait")
+    parser.add_argument("--retry-failed", action="store_true", help="rerun lines whose last result failed")
+    parser.add_argument("--wait-callbacks", action=argparse.BooleanOptionalAction, default=True,
+                        help="wait for evaluation callbacks to be delivered before exiting")
+    args = parser.parse_args()
+    if args.output is None:
+        args.output = os.path.splitext(args.input)[0] + ".results.jsonl"
+
+    try:
+        counts = run(args)
+    except KeyboardInterrupt:
+        print(f"Interrupted; rerun the same command to resume from {args.output}", file=sys.stderr)
+        os._exit(130)
+    print(" ".join(f"{name}={count}" for name, count in counts.items()))
+    sys.exit(1 if counts["failed"] or counts["invalid"] else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,185 @@
+// Runs a task's JavaScript checks against a generated page, for local_checks.py.
+// Reads one JSON request per line on stdin:
+//   {"id", "html", "checks": [...], "files": {name: base64}, "script_timeout_ms", "settle_ms"}
+// and writes one JSON reply per line on stdout:
+//   {"id", "results": [{"check", "status": "pass"|"fail"|"error"|"skipped", "error"}],
+//    "errors": [...], "unloaded": [...]}
+// Nothing goes to the network: the page's relative URLs are served from `files`,
+// anything else fails (fetch/XMLHttpRequest) or isn't loaded (external scripts).
+const readline = require("readline");
+const vm = require("vm");
+const { JSDOM, VirtualConsole, ResourceLoader } = require("jsdom");
+
+const ORIGIN = "http://localhost";
+const MAX_ERRORS = 20;
+const MIME = {
+  ".js": "text/javascript", ".css": "text/css", ".json": "application/json", ".csv": "text/csv",
+  ".md": "text/markdown", ".txt": "text/plain", ".svg": "image/svg+xml", ".png": "image/png",
+  ".jpg": "image/jpeg", ".jpeg": "image/jpeg", ".gif": "image/gif", ".webp": "image/webp",
+};
+
+function mimeType(name) {
+  const dot = name.lastIndexOf(".");
+  return MIME[dot >= 0 ? name.slice(dot).toLowerCase() : ""] || "application/octet-stream";
+}
+
+function localFile(files, href) {
+  const url = new URL(href, ORIGIN + "/");
+  if (url.origin !== ORIGIN) {
+    return null;
+  }
+  const name = decodeURIComponent(url.pathname.replace(/^\/+/, ""));
+  return Object.prototype.hasOwnProperty.call(files, name) ? name : null;
+}
+
+class LocalResources extends ResourceLoader {
+  constructor(files, unloaded) {
+    super();
+    this.files = files;
+    this.unloaded = unloaded;
+  }
+
+  fetch(href, options) {
+    const name = localFile(this.files, href);
+    if (name === null) {
+      // CDN scripts and the like; checks depending on them may fail here but pass live
+      this.unloaded.push(href);
+      return null;
+    }
+    return Promise.resolve(Buffer.from(this.files[name], "base64"));
+  }
+}
+
+// Checks are expressions ("document.title === 'x'") or, failing that, function
+// bodies; text that is neither (a check written in prose) is skipped
+function compile(check) {
+  const source = check.trim().replace(/^js:\s*/i, "");
+  for (const wrapped of [`(async () => (${source}\n))()`, `(async () => {${source}\n})()`]) {
+    try {
+      return new vm.Script(wrapped);
+    } catch (e) {
+      if (!(e instanceof SyntaxError)) {
+        throw e;
+      }
+    }
+  }
+  return null;
+}
+
+function withTimeout(promise, ms) {
+  let timer;
+  const timeout = new Promise((_, reject) => {
+    timer = setTimeout(() => reject(new Error(`timed out after ${ms}ms`)), ms);
+  });
+  return Promise.race([promise, timeout]).finally(() => clearTimeout(timer));
+}
+
+function message(e) {
+  return String((e && (e.message || (e.detail && e.detail.message))) || e).slice(0, 300);
+}
+
+async function run(request) {
+  const files = request.files || {};
+  const errors = [];
+  const unloaded = [];
+  const virtualConsole = new VirtualConsole();
+  virtualConsole.on("jsdomError", (e) => {
+    if (errors.length < MAX_ERRORS) {
+      errors.push(message(e));
+    }
+  });
+
+  const dom = new JSDOM(request.html, {
+    url: ORIGIN + "/index.html",
+    runScripts: "dangerously",
+    pretendToBeVisual: true,
+    resources: new LocalResources(files, unloaded),
+    virtualConsole,
+    beforeParse(window) {
+      window.fetch = async (input) => {
+        const href = String((input && input.url) || input);
+        const name = localFile(files, new URL(href, window.location.href).href);
+        if (name === null) {
+          throw new window.TypeError(`Failed to fetch ${href}: no network in local checks`);
+        }
+        return new Response(Buffer.from(files[name], "base64"),
+                            { status: 200, headers: { "Content-Type": mimeType(name) } });
+      };
+      delete window.XMLHttpRequest;
+      delete window.WebSocket;
+    },
+  });
+  const window = dom.window;
+  try {
+    if (window.document.readyState !== "complete") {
+      await withTimeout(new Promise((resolve) => window.addEventListener("load", resolve)),
+                        request.settle_ms * 4 + 1000).catch(() => {});
+    }
+    // Let timers and fetches started on load render before checking
+    await new Promise((resolve) => setTimeout(resolve, request.settle_ms));
+
+    const context = dom.getInternalVMContext();
+    const results = [];
+    for (const check of request.checks) {
+      let script;
+      try {
+        script = compile(check);
+      } catch (e) {
+        results.push({ check, status: "error", error: message(e) });
+        continue;
+      }
+      if (script === null) {
+        results.push({ check, status: "skipped", error: "not a JavaScript check" });
+        continue;
+      }
+      try {
+        const value = await withTimeout(script.runInContext(context, { timeout: request.script_timeout_ms }),
+                                        request.script_timeout_ms);
+        results.push({ check, status: value ? "pass" : "fail", error: null });
+      } catch (e) {
+        results.push({ check, status: "error", error: message(e) });
+      }
+    }
+    return { id: request.id, results, errors, unloaded };
+  } finally {
+    window.close();
+  }
+}
+
+// One page at a time: an inline script that never returns blocks this process,
+// and local_checks.py kills it when the page's deadline passes
+const queue = [];
+let busy = false;
+
+async function drain() {
+  if (busy) {
+    return;
+  }
+  busy = true;
+  while (queue.length) {
+    const line = queue.shift();
+    let reply;
+    try {
+      const request = JSON.parse(line);
+      try {
+        reply = await run(request);
+      } catch (e) {
+        reply = { id: request.id, error: message(e) };
+      }
+    } catch (e) {
+      reply = { id: null, error: `bad request: ${message(e)}` };
+    }
+    process.stdout.write(JSON.stringify(reply) + "\n");
+  }
+  busy = false;
+}
+
+// A page's stray promise rejections must not take the worker down with them
+process.on("unhandledRejection", () => {});
+
+readline.createInterface({ input: process.stdin }).on("line", (line) => {
+  if (line.trim()) {
+    queue.push(line);
+    drain();
+  }
+});
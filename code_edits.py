@@ -0,0 +1,94 @@
+import re
+
+EDIT_FORMAT = """<<<<<<< SEARCH
+exact lines copied from the current file
+=======
+the lines that replace them
+>>>>>>> REPLACE"""
+
+_BLOCK = re.compile(
+    r"<<<<<<< SEARCH\n(.*?)\n?=======\n(.*?)\n?>>>>>>> REPLACE",
+    re.DOTALL,
+)
+_FENCE = re.compile(r"^```[a-zA-Z]*\n|\n?```\s*$")
+
+
+def strip_fences(text: str) -> str:
+    """
+    Drop a surrounding markdown code fence if the model added one anyway.
+    """
+    return _FENCE.sub("", text.strip())
+
+
+def parse_edits(text: str) -> list[tuple[str, str]]:
+    """
+    Parse SEARCH/REPLACE blocks into (search, replace) pairs.
+    """
+    return [(m.group(1), m.group(2)) for m in _BLOCK.finditer(strip_fences(text))]
+
+
+def apply_edits(source: str, edits: list[tuple[str, str]]) -> str:
+    """
+    Apply edits in order. Each search text must occur in the file; an exact
+    match is tried first, then one that ignores trailing whitespace per line.
+    Raises ValueError if any block doesn't apply.
+    """
+    if not edits:
+        raise ValueError("No edit blocks found")
+    result = source
+    for i, (search, replace) in enumerate(edits, start=1):
+        if not search.strip():
+            raise ValueError(f"Edit {i} has an empty search block")
+        if search in result:
+            result = result.replace(search, replace, 1)
+            continue
+        pattern = "\n".join(re.escape(line.rstrip()) + r"[ \t]*" for line in search.split("\n"))
+        match = re.search(pattern, result)
+        if match is None:
+            raise ValueError(f"Edit {i} search text not found")
+        result = result[:match.start()] + replace + result[match.end():]
+    return result
+
+
+def looks_like_html(code: str) -> bool:
+    lowered = code.lower()
+    return "<html" in lowered and "</html>" in lowered
+
+
+def _unfenced_start(text: str):
+    """
+    The start of a streamed reply without a leading markdown fence, which
+    strip_fences removes anyway; None while the fence line is still arriving.
+    """
+    start = text.lstrip()
+    if start.startswith("```"):
+        newline = start.find("\n")
+        if newline == -1:
+            return None
+        start = start[newline + 1:].lstrip()
+    return start
+
+
+def html_stream_error(text: str):
+    """
+    Cheap check on the start of a streamed full-page generation.
+    Returns why it should be cancelled, or None. Only what strip_fences can't
+    repair cancels it: a leading fence is fine, prose is not.
+    """
+    start = _unfenced_start(text)
+    if start is None or len(start) < 16:
+        return None
+    lowered = start.lower()
+    if not lowered.startswith(("<!doctype", "<html", "<!--")):
+        return "no <html> root"
+    return None
+
+
+def edit_stream_error(text: str):
+    """
+    Same for edit replies, which must open with a SEARCH block.
+    """
+    start = _unfenced_start(text)
+    if start is not None and len(start) >= 7 and not start.startswith("<<<<<<<"):
+        return "no edit block"
+    return None
@@ -0,0 +1,160 @@
+import os
+import math
+import time
+import threading
+from collections import deque
+
+import metrics
+
+# Jobs waiting to start, all tenants together; past this new tasks get a 429
+QUEUE_MAX_DEPTH = int(os.getenv("QUEUE_MAX_DEPTH", "64"))
+# Jobs one tenant may have waiting
+TENANT_MAX_QUEUED = int(os.getenv("TENANT_MAX_QUEUED", "16"))
+# Jobs one tenant may have running while another tenant has jobs waiting;
+# 0 keeps one worker free for the other tenants, -1 is no cap
+TENANT_MAX_RUNNING = int(os.getenv("TENANT_MAX_RUNNING", "0"))
+# "tenant=weight,..." shares of the workers; tenants not listed weigh 1
+TENANT_WEIGHTS = os.getenv("TENANT_WEIGHTS", "")
+# Retry-After when nothing has finished recently to measure the drain rate by
+DEFAULT_RETRY_AFTER = 30
+MAX_RETRY_AFTER = 600
+DRAIN_WINDOW = 300.0
+
+
+def parse_weights(spec: str) -> dict:
+    weights = {}
+    for part in spec.split(","):
+        name, _, weight = part.strip().rpartition("=")
+        if name:
+            weights[name] = float(weight)
+    return weights
+
+
+class QueueFull(Exception):
+    """
+    A job refused at admission; retry_after is the estimated wait in seconds.
+    """
+
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class FairQueue:
+    """
+    Weighted fair queuing of jobs between tenants. Each job gets a virtual
+    finish tag (tenant's last tag, or the current virtual time if later, plus
+    cost / weight) and workers take the smallest tag among tenants under their
+    running cap, so a tenant flooding the queue with costly jobs only delays
+    its own. The cap only applies while another tenant has jobs waiting: a
+    tenant alone gets every worker. admit() refuses jobs with QueueFull once the queue, or the
+    tenant's share of it, is full, with a Retry-After from the recent drain rate.
+    """
+
+    def __init__(self, workers: int, max_depth: int = QUEUE_MAX_DEPTH, tenant_max_queued: int = TENANT_MAX_QUEUED,
+                 tenant_max_running: int = TENANT_MAX_RUNNING, weights: dict = None):
+        self.max_depth = max_depth
+        self.tenant_max_queued = tenant_max_queued
+        if tenant_max_running == 0:
+            tenant_max_running = max(workers - 1, 1)
+        self.tenant_max_running = tenant_max_running if tenant_max_running > 0 else workers
+        self.weights = weights if weights is not None else parse_weights(TENANT_WEIGHTS)
+        self.queues = {}
+        self.running = {}
+        self.last_finish = {}
+        self.virtual_time = 0.0
+        self.depth = 0
+        self.finished = deque()
+        self.cond = threading.Condition()
+
+    def put(self, tenant: str, item, cost: float = 1.0):
+        """
+        Queue item for tenant; cost is its expected work relative to other jobs.
+        Doesn't check admission, see admit().
+        """
+        with self.cond:
+            start = max(self.virtual_time, self.last_finish.get(tenant, 0.0))
+            finish = start + cost / self.weights.get(tenant, 1.0)
+            self.last_finish[tenant] = finish
+            self.queues.setdefault(tenant, deque()).append((start, finish, item))
+            self.depth += 1
+            self.cond.notify()
+
+    def get(self):
+        """
+        Block until a job may start; returns (tenant, item). Call done(tenant) after.
+        """
+        with self.cond:
+            while True:
+                chosen = None
+                contended = len(self.queues) > 1
+                for tenant, queue in self.queues.items():
+                    if contended and self.running.get(tenant, 0) >= self.tenant_max_running:
+                        continue
+                    if chosen is None or queue[0][1] < self.queues[chosen][0][1]:
+                        chosen = tenant
+                if chosen is not None:
+                    break
+                self.cond.wait()
+            queue = self.queues[chosen]
+            start, _, item = queue.popleft()
+            if not queue:
+                del self.queues[chosen]
+            self.depth -= 1
+            self.virtual_time = max(self.virtual_time, start)
+            self.running[chosen] = self.running.get(chosen, 0) + 1
+            return chosen, item
+
+    def done(self, tenant: str):
+        with self.cond:
+            self.running[tenant] -= 1
+            if not self.running[tenant]:
+                del self.running[tenant]
+            if tenant not in self.queues and tenant not in self.running \
+                    and self.last_finish.get(tenant, 0.0) <= self.virtual_time:
+                # Idle and caught up: its next job starts at the virtual time anyway
+                self.last_finish.pop(tenant, None)
+            self.finished.append((time.monotonic(), tenant))
+            self._drain_rate()
+            self.cond.notify_all()
+
+    def stats(self) -> dict:
+        # Counts only: tenants are submitters' emails
+        with self.cond:
+            rate = self._drain_rate()
+            return {"queued": self.depth, "running": sum(self.running.values()),
+                    "tenants": len(set(self.queues) | set(self.running)), "max_depth": self.max_depth,
+                    "tenant_max_queued": self.tenant_max_queued, "tenant_max_running": self.tenant_max_running,
+                    "drain_per_second": round(rate, 4) if rate is not None else None}
+
+    def admit(self, tenant: str):
+        """
+        Raises QueueFull if a new job of tenant's shouldn't be queued now.
+        """
+        with self.cond:
+            if self.depth >= self.max_depth:
+                metrics.admission_rejections_total.inc(reason="queue_full")
+                raise QueueFull(f"Queue is full ({self.depth} tasks waiting)",
+                                self._retry_after(self.depth - self.max_depth + 1))
+            queued = len(self.queues.get(tenant, ()))
+            if self.tenant_max_queued > 0 and queued >= self.tenant_max_queued:
+                metrics.admission_rejections_total.inc(reason="tenant_full")
+                raise QueueFull(f"Too many tasks waiting for {tenant} ({queued})",
+                                self._retry_after(queued - self.tenant_max_queued + 1, tenant))
+
+    def _drain_rate(self, tenant: str = None):
+        # Jobs finished per second over the last DRAIN_WINDOW, for everyone or one tenant
+        now = time.monotonic()
+        while self.finished and now - self.finished[0][0] > DRAIN_WINDOW:
+            self.finished.popleft()
+        times = [t for t, who in self.finished if tenant is None or who == tenant]
+        if len(times) < 2:
+            return None
+        return len(times) / max(now - times[0], 1.0)
+
+    def _retry_after(self, backlog: int, tenant: str = None) -> int:
+        # Time for `backlog` queued jobs to start at the measured drain rate
+        rate = self._drain_rate(tenant) or self._drain_rate()
+        if rate is None:
+            return DEFAULT_RETRY_AFTER
+        return int(min(max(math.ceil(backlog / rate), 1), MAX_RETRY_AFTER))
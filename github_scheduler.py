@@ -0,0 +1,190 @@
+import os
+import time
+import random
+import threading
+from collections import OrderedDict
+
+import requests
+
+import http_client
+from jobs import log
+
+GITHUB_MAX_RETRIES = int(os.getenv("GITHUB_MAX_RETRIES", "5"))
+# GitHub asks for content-creating calls to be made (close to) serially
+GITHUB_MAX_CONCURRENT_WRITES = int(os.getenv("GITHUB_MAX_CONCURRENT_WRITES", "3"))
+GITHUB_BURST = float(os.getenv("GITHUB_BURST", "20"))
+# Below this many remaining calls in the window, requests get paced
+GITHUB_RATE_RESERVE = int(os.getenv("GITHUB_RATE_RESERVE", "500"))
+GITHUB_ETAG_ENTRIES = int(os.getenv("GITHUB_ETAG_ENTRIES", "1024"))
+BACKOFF_BASE = 1.0
+BACKOFF_MAX = 60.0
+
+WRITE_METHODS = ("POST", "PUT", "PATCH", "DELETE")
+
+
+class TokenBucket:
+    """
+    Paces requests to the primary rate limit. While plenty of quota is left
+    requests go straight through; once X-RateLimit-Remaining drops below the
+    reserve, the refill rate is derived from Remaining / time until Reset so
+    what's left is spread over the rest of the window instead of running out.
+    """
+
+    def __init__(self, capacity: float = GITHUB_BURST, reserve: int = GITHUB_RATE_RESERVE):
+        self.capacity = capacity
+        self.reserve = reserve
+        self.rate = None
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                if self.rate is None:
+                    return
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate if self.rate > 0 else 1.0
+            time.sleep(min(wait, BACKOFF_MAX))
+
+    def update(self, remaining: int, reset_at: float):
+        window = max(reset_at - time.time(), 1.0)
+        with self.lock:
+            if remaining > self.reserve:
+                self.rate = None
+                self.tokens = self.capacity
+                return
+            if self.rate is None:
+                self.updated = time.monotonic()
+            self.rate = max(remaining, 0) / window
+            # Never hold more tokens than the quota actually left
+            self.tokens = min(self.tokens, float(remaining))
+
+
+class GitHubScheduler:
+    """
+    Central entry point for GitHub API calls: token-bucket pacing from the
+    rate-limit headers, a cap on concurrent writes, jittered exponential
+    backoff on rate limits / 5xx, and ETag revalidation for GETs
+    (304s don't count against the quota).
+    """
+
+    def __init__(self, upstream: http_client.Upstream):
+        self.upstream = upstream
+        self.bucket = TokenBucket()
+        self.writes = threading.BoundedSemaphore(GITHUB_MAX_CONCURRENT_WRITES)
+        self.etags = OrderedDict()
+        self.lock = threading.Lock()
+        self.paused_until = 0.0
+
+    def get(self, url: str, **kwargs) -> requests.Response:
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url: str, **kwargs) -> requests.Response:
+        return self.request("POST", url, **kwargs)
+
+    def put(self, url: str, **kwargs) -> requests.Response:
+        return self.request("PUT", url, **kwargs)
+
+    def patch(self, url: str, **kwargs) -> requests.Response:
+        return self.request("PATCH", url, **kwargs)
+
+    def request(self, method: str, url: str, **kwargs) -> requests.Response:
+        headers = dict(kwargs.pop("headers", None) or {})
+        cache_key = (url, headers.get("Accept", ""))
+        cached = None
+        if method == "GET":
+            with self.lock:
+                cached = self.etags.get(cache_key)
+                if cached is not None:
+                    self.etags.move_to_end(cache_key)
+            if cached is not None:
+                headers["If-None-Match"] = cached[0]
+
+        for attempt in range(GITHUB_MAX_RETRIES + 1):
+            self._wait_for_pause()
+            self.bucket.acquire()
+            try:
+                if method in WRITE_METHODS:
+                    with self.writes:
+                        response = self.upstream.request(method, url, headers=headers, retry=attempt, **kwargs)
+                else:
+                    response = self.upstream.request(method, url, headers=headers, retry=attempt, **kwargs)
+            except requests.ConnectionError as e:
+                if attempt == GITHUB_MAX_RETRIES:
+                    raise
+                delay = self._backoff(attempt)
+                log(f"GitHub {method} {url} failed ({e}), retrying in {delay:.1f}s")
+                time.sleep(delay)
+                continue
+
+            self._update_limits(response)
+            if response.status_code == 304 and cached is not None:
+                return cached[1]
+            delay = self._retry_delay(response, attempt)
+            if delay is None or attempt == GITHUB_MAX_RETRIES:
+                break
+            log(f"GitHub {method} {url} -> {response.status_code}, retrying in {delay:.1f}s")
+            time.sleep(delay)
+
+        if method == "GET" and response.status_code == 200 and response.headers.get("ETag"):
+            with self.lock:
+                self.etags[cache_key] = (response.headers["ETag"], response)
+                self.etags.move_to_end(cache_key)
+                while len(self.etags) > GITHUB_ETAG_ENTRIES:
+                    self.etags.popitem(last=False)
+        return response
+
+    def _wait_for_pause(self):
+        delay = self.paused_until - time.time()
+        if delay > 0:
+            time.sleep(delay)
+
+    def _backoff(self, attempt: int) -> float:
+        # Full jitter
+        return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+
+    def _update_limits(self, response: requests.Response):
+        remaining = response.headers.get("X-RateLimit-Remaining")
+        reset = response.headers.get("X-RateLimit-Reset")
+        if remaining is not None and reset is not None:
+            try:
+                self.bucket.update(int(remaining), float(reset))
+            except ValueError:
+                pass
+
+    def _retry_delay(self, response: requests.Response, attempt: int):
+        """
+        Seconds to wait before retrying, or None if the response is final.
+        Rate-limit waits also pause every other caller.
+        """
+        status = response.status_code
+        if status >= 500:
+            return self._backoff(attempt)
+        if status not in (403, 429):
+            return None
+        retry_after = response.headers.get("Retry-After")
+        remaining = response.headers.get("X-RateLimit-Remaining")
+        if retry_after is not None:
+            try:
+                delay = float(retry_after)
+            except ValueError:
+                delay = self._backoff(attempt)
+        elif remaining == "0":
+            delay = max(float(response.headers.get("X-RateLimit-Reset", time.time())) - time.time(), 1.0)
+        elif status == 429 or "rate limit" in response.text.lower():
+            # Secondary limit without a hint: back off exponentially, at least a minute per docs
+            delay = max(60.0, self._backoff(attempt))
+        else:
+            return None
+        delay = min(delay, 15 * 60) + random.uniform(0, 1)
+        self.paused_until = max(self.paused_until, time.time() + delay)
+        return delay
+
+
+github = GitHubScheduler(http_client.github)
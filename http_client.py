@@ -0,0 +1,101 @@
+import os
+import time
+import threading
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import metrics
+
+GITHUB_TOKEN = os.getenv("GITHUB_TOKEN")
+AIAPI_KEY = os.getenv("AIAPI_KEY")
+
+CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "5"))
+READ_TIMEOUT = float(os.getenv("HTTP_READ_TIMEOUT", "30"))
+LLM_READ_TIMEOUT = float(os.getenv("LLM_READ_TIMEOUT", "120"))
+
+
+class Upstream:
+    """
+    A keep-alive connection pool to one upstream service.
+    Holds the shared auth headers and default (connect, read) timeouts,
+    so call sites only pass what differs per request.
+    """
+
+    def __init__(self, name: str, headers: dict = None, max_connections: int = 10,
+                 connect_timeout: float = CONNECT_TIMEOUT, read_timeout: float = READ_TIMEOUT):
+        self.name = name
+        self.timeout = (connect_timeout, read_timeout)
+        self.session = requests.Session()
+        # Retries are handled by the callers, the adapter only pools connections
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_connections,
+                              pool_block=True, max_retries=0)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        if headers:
+            self.session.headers.update(headers)
+
+    def request(self, method: str, url: str, retry: int = 0, **kwargs) -> requests.Response:
+        """
+        retry is the attempt number when the caller is retrying, used to label metrics.
+        """
+        kwargs.setdefault("timeout", self.timeout)
+        start = time.perf_counter()
+        status = "error"
+        try:
+            response = self.session.request(method, url, **kwargs)
+            status = str(response.status_code)
+            return response
+        finally:
+            metrics.upstream_seconds.observe(time.perf_counter() - start,
+                                             upstream=self.name, method=method, status=status)
+            metrics.upstream_total.inc(upstream=self.name, method=method, status=status, retry=retry)
+
+    def get(self, url: str, **kwargs) -> requests.Response:
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url: str, **kwargs) -> requests.Response:
+        return self.request("POST", url, **kwargs)
+
+    def put(self, url: str, **kwargs) -> requests.Response:
+        return self.request("PUT", url, **kwargs)
+
+    def patch(self, url: str, **kwargs) -> requests.Response:
+        return self.request("PATCH", url, **kwargs)
+
+
+github = Upstream(
+    "github",
+    headers={"Authorization": f"Bearer {GITHUB_TOKEN}",
+             "Accept": "application/vnd.github.v3+json"},
+    max_connections=int(os.getenv("GITHUB_MAX_CONNECTIONS", "10")),
+)
+
+llm = Upstream(
+    "llm",
+    headers={"Content-Type": "application/json",
+             "Authorization": f"Bearer {AIAPI_KEY}"},
+    max_connections=int(os.getenv("LLM_MAX_CONNECTIONS", "8")),
+    read_timeout=LLM_READ_TIMEOUT,
+)
+
+_evaluation_hosts = {}
+_evaluation_lock = threading.Lock()
+
+
+def evaluation(url: str) -> Upstream:
+    """
+    Evaluation URLs come with each task, so keep one pool per host.
+    """
+    host = urlsplit(url).netloc
+    with _evaluation_lock:
+        upstream = _evaluation_hosts.get(host)
+        if upstream is None:
+            upstream = Upstream(
+                f"evaluation:{host}",
+                headers={"Content-Type": "application/json"},
+                max_connections=int(os.getenv("EVALUATION_MAX_CONNECTIONS", "4")),
+            )
+            _evaluation_hosts[host] = upstream
+        return upstream
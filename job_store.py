@@ -0,0 +1,99 @@
+import os
+import json
+import time
+import sqlite3
+import threading
+
+JOB_DB_PATH = os.getenv("JOB_DB_PATH", "jobs.db")
+
+
+class JobStore:
+    """
+    SQLite-backed record of every job, one row per (task, nonce, round),
+    so a retried submission can find the job it duplicates even after a restart.
+    Also holds each running job's checkpoints (its input and the output of every
+    finished step), so a job cut short by a restart can pick up where it was.
+    """
+
+    def __init__(self, path: str = JOB_DB_PATH):
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.lock = threading.Lock()
+        with self.lock, self.conn:
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    task TEXT NOT NULL,
+                    nonce TEXT NOT NULL,
+                    round INTEGER NOT NULL,
+                    status TEXT NOT NULL,
+                    job TEXT NOT NULL,
+                    UNIQUE (task, nonce, round)
+                )
+                """
+            )
+            self.conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS checkpoints (
+                    job_id TEXT NOT NULL,
+                    name TEXT NOT NULL,
+                    value TEXT NOT NULL,
+                    saved_at REAL NOT NULL,
+                    PRIMARY KEY (job_id, name)
+                )
+                """
+            )
+
+    def save(self, job: dict):
+        with self.lock, self.conn:
+            self.conn.execute(
+                """
+                INSERT INTO jobs (id, task, nonce, round, status, job) VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT (task, nonce, round) DO UPDATE SET
+                    id = excluded.id, status = excluded.status, job = excluded.job
+                """,
+                (job["id"], str(job["task"]), str(job["nonce"]), job["round"], job["status"],
+                 json.dumps(job, default=str)),
+            )
+
+    def get(self, job_id: str):
+        with self.lock:
+            row = self.conn.execute("SELECT job FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def find(self, task: str, nonce: str, round: int):
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT job FROM jobs WHERE task = ? AND nonce = ? AND round = ?",
+                (str(task), str(nonce), round),
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def unfinished(self) -> list[dict]:
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT job FROM jobs WHERE status IN ('queued', 'running')"
+            ).fetchall()
+        return [json.loads(r[0]) for r in rows]
+
+    def save_checkpoint(self, job_id: str, name: str, value):
+        with self.lock, self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO checkpoints (job_id, name, value, saved_at) VALUES (?, ?, ?, ?)",
+                (job_id, name, json.dumps(value), time.time()),
+            )
+
+    def load_checkpoint(self, job_id: str, name: str):
+        """
+        (True, value) if the step was saved, else (False, None); a step can save None.
+        """
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT value FROM checkpoints WHERE job_id = ? AND name = ?", (job_id, name)
+            ).fetchone()
+        return (True, json.loads(row[0])) if row else (False, None)
+
+    def drop_checkpoints(self, job_id: str):
+        with self.lock, self.conn:
+            self.conn.execute("DELETE FROM checkpoints WHERE job_id = ?", (job_id,))
@@ -0,0 +1,253 @@
+import os
+import time
+import uuid
+import threading
+import traceback
+from contextlib import contextmanager
+from job_store import JobStore
+from fair_queue import FairQueue
+import metrics
+
+MAX_WORKERS = int(os.getenv("MAX_WORKERS", "4"))
+# A job cut short by a restart is resumed from its checkpoints this many times, then failed
+JOB_MAX_RESUMES = int(os.getenv("JOB_MAX_RESUMES", "2"))
+
+_local = threading.local()
+
+
+class JobQueue:
+    """
+    Runs pipeline jobs on a bounded pool of worker threads and keeps
+    their state (stage, timings, result) so it can be polled by id.
+    Workers take jobs from a FairQueue shared out by tenant (the task's email);
+    submit() raises QueueFull when it's full.
+    Jobs are persisted in a JobStore and deduplicated on (task, nonce, round):
+    a repeated submission gets the existing job back instead of new work.
+    Pipelines save their progress with checkpoint(), and resume() restarts the
+    jobs a previous process left unfinished from their last checkpoint.
+    """
+
+    def __init__(self, max_workers: int = MAX_WORKERS, store: JobStore = None):
+        self.queue = FairQueue(workers=max_workers)
+        self.store = store if store is not None else JobStore()
+        self.jobs = {}
+        self.keys = {}
+        self.lock = threading.Lock()
+        # Anything still queued/running belongs to a previous process, see resume()
+        self.interrupted = self.store.unfinished()
+        for i in range(max_workers):
+            threading.Thread(target=self._work, name=f"job-{i}", daemon=True).start()
+
+    def submit(self, fn, data: dict):
+        """
+        Returns (job, created). created is False when the submission
+        attached to an existing queued, running or finished job.
+        """
+        key = (str(data.get("task")), str(data.get("nonce")), data.get("round"))
+        with self.lock:
+            existing = self.jobs.get(self.keys.get(key)) or self.store.find(*key)
+            if existing is not None and existing["status"] != "failed":
+                return self._snapshot(existing), False
+            self.queue.admit(job_tenant(data))
+            job_id = uuid.uuid4().hex
+            job = {
+                "id": job_id,
+                "task": data.get("task"),
+                "nonce": data.get("nonce"),
+                "round": data.get("round"),
+                "trace_id": job_id[:12],
+                "status": "queued",
+                "stage": None,
+                "submitted_at": time.time(),
+                "started_at": None,
+                "finished_at": None,
+                "timings": {},
+                "prompt_tokens_saved": 0,
+                "local_checks": None,
+                "resumes": 0,
+                "result": None,
+                "error": None,
+            }
+            self.jobs[job_id] = job
+            self.keys[key] = job_id
+            self.store.save(job)
+            # The secret has been checked already, resuming doesn't need it
+            self.store.save_checkpoint(job_id, "input", {k: v for k, v in data.items() if k != "secret"})
+            self.queue.put(job_tenant(data), (job, fn, data), job_cost(data))
+        return self._snapshot(job), True
+
+    def resume(self, pipeline_for):
+        """
+        Requeue the jobs interrupted by the last restart; pipeline_for(data) gives
+        the function to run for a job's saved input. Jobs without one, or that
+        were already resumed JOB_MAX_RESUMES times (they may be what kills the
+        process), are failed instead.
+        """
+        interrupted, self.interrupted = self.interrupted, []
+        for job in interrupted:
+            found, data = self.store.load_checkpoint(job["id"], "input")
+            fn = pipeline_for(data) if found else None
+            job["stage"] = None
+            if fn is None or job.get("resumes", 0) >= JOB_MAX_RESUMES:
+                job["status"] = "failed"
+                job["error"] = "Interrupted by restart"
+                self.store.save(job)
+                self.store.drop_checkpoints(job["id"])
+                continue
+            job["status"] = "queued"
+            job["resumes"] = job.get("resumes", 0) + 1
+            key = (str(job["task"]), str(job["nonce"]), job["round"])
+            with self.lock:
+                self.jobs[job["id"]] = job
+                self.keys[key] = job["id"]
+                self.store.save(job)
+            log(f"Resuming job {job['id']} (trace {job['trace_id']}) after a restart")
+            # Admitted before the restart, so not subject to the queue limits again
+            self.queue.put(job_tenant(data), (job, fn, data), job_cost(data))
+
+    def stats(self) -> dict:
+        return self.queue.stats()
+
+    def get(self, job_id: str):
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if job is not None:
+                return self._snapshot(job)
+        return self.store.get(job_id)
+
+    def _snapshot(self, job: dict) -> dict:
+        job = dict(job)
+        job["timings"] = dict(job["timings"])
+        return job
+
+    def _finish(self, job: dict):
+        with self.lock:
+            self.store.save(self._snapshot(job))
+            self.store.drop_checkpoints(job["id"])
+            # Finished jobs are served from the store from now on
+            self.jobs.pop(job["id"], None)
+            key = (str(job["task"]), str(job["nonce"]), job["round"])
+            if self.keys.get(key) == job["id"]:
+                del self.keys[key]
+
+    def _work(self):
+        while True:
+            tenant, (job, fn, data) = self.queue.get()
+            if not job["resumes"]:
+                waited = time.time() - job["submitted_at"]
+                metrics.stage_seconds.observe(waited, stage="queue")
+                job["timings"]["queue"] = round(waited, 4)
+            try:
+                self._run(job, fn, data)
+            finally:
+                self.queue.done(tenant)
+
+    def _run(self, job: dict, fn, data: dict):
+        _local.job = job
+        _local.store = self.store
+        job["status"] = "running"
+        # A resumed job keeps its original start
+        job["started_at"] = job["started_at"] or time.time()
+        self.store.save(self._snapshot(job))
+        try:
+            job["result"] = fn(data)
+            job["status"] = "done"
+        except Exception as e:
+            job["status"] = "failed"
+            job["error"] = f"{type(e).__name__}: {e}"
+            log(f"Job failed: {job['error']}")
+            traceback.print_exc()
+        finally:
+            job["stage"] = None
+            job["finished_at"] = time.time()
+            metrics.jobs_total.inc(round=job["round"], status=job["status"])
+            self._finish(job)
+            _local.job = None
+            _local.store = None
+
+
+def job_tenant(data: dict) -> str:
+    # Whose share of the workers a task uses
+    return str(data.get("email") or data.get("task"))
+
+
+def job_cost(data: dict) -> float:
+    # Round 2 runs an LLM call and a push per subround, unless they're folded into one
+    if data.get("round") == 2 and not data.get("fold_subrounds"):
+        return float(max(len(data.get("round2", [])), 1))
+    return 1.0
+
+
+def current_job():
+    return getattr(_local, "job", None)
+
+
+def bind_job(fn):
+    """
+    Wrap fn so it runs with the calling thread's job, for work handed
+    off to helper threads inside a pipeline.
+    """
+    job = current_job()
+    store = getattr(_local, "store", None)
+
+    def run(*args, **kwargs):
+        previous = current_job(), getattr(_local, "store", None)
+        _local.job, _local.store = job, store
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            _local.job, _local.store = previous
+    return run
+
+
+def checkpoint(name: str, compute):
+    """
+    The current job's saved result of step `name`, if an interrupted run of the
+    job got that far; otherwise compute(), saved before it's returned. Values
+    must be JSON-serialisable. Outside a job this is just compute().
+    """
+    job = current_job()
+    store = getattr(_local, "store", None)
+    if job is None or store is None:
+        return compute()
+    found, value = store.load_checkpoint(job["id"], name)
+    if found:
+        log(f"Skipping {name}, done before the restart")
+        return value
+    value = compute()
+    store.save_checkpoint(job["id"], name, value)
+    return value
+
+
+@contextmanager
+def stage(name: str):
+    """
+    Record a pipeline stage on the job running in this thread (if any).
+    Repeated stages (e.g. one per round-2 subround) accumulate their time.
+    """
+    job = current_job()
+    previous = job.get("stage") if job is not None else None
+    if job is not None:
+        job["stage"] = name
+    start = time.perf_counter()
+    outcome = "error"
+    try:
+        yield
+        outcome = "ok"
+    finally:
+        elapsed = time.perf_counter() - start
+        metrics.stage_seconds.observe(elapsed, stage=name)
+        metrics.stage_total.inc(stage=name, outcome=outcome)
+        if job is not None:
+            job["timings"][name] = round(job["timings"].get(name, 0.0) + elapsed, 4)
+            job["stage"] = previous
+
+
+def log(message: str):
+    """
+    print() tagged with the current job's trace id, so interleaved
+    workers' output can be told apart.
+    """
+    job = current_job()
+    trace_id = job.get("trace_id") if job is not None else None
+    print(f"[{trace_id}] {message}" if trace_id else message)
@@ -0,0 +1,208 @@
+import os
+import json
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+
+LLM_CACHE_DIR = os.getenv("LLM_CACHE_DIR", ".llm_cache")
+LLM_CACHE_TTL = float(os.getenv("LLM_CACHE_TTL", str(7 * 24 * 3600)))
+LLM_CACHE_MEMORY_ENTRIES = int(os.getenv("LLM_CACHE_MEMORY_ENTRIES", "256"))
+LLM_CACHE_DISK_BYTES = int(float(os.getenv("LLM_CACHE_DISK_MB", "100")) * 1024 * 1024)
+
+
+def cache_key(payload: dict) -> str:
+    """
+    Content hash of the parts of a chat-completions payload that decide the output.
+    """
+    material = {
+        "model": payload.get("model"),
+        "temperature": payload.get("temperature"),
+        "max_tokens": payload.get("max_tokens"),
+        "messages": payload.get("messages"),
+    }
+    # Only set for extra samples of a prompt, so unseeded keys stay as they were
+    if payload.get("seed") is not None:
+        material["seed"] = payload["seed"]
+    blob = json.dumps(material, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+
+class LLMCache:
+    """
+    Two-tier cache of LLM completions: an in-memory LRU in front of a
+    size-bounded directory of JSON files that survives restarts.
+    Entries are {"content": ..., "usage": {...}, "elapsed": seconds, "created": ts}.
+    """
+
+    def __init__(self, directory: str = LLM_CACHE_DIR, ttl: float = LLM_CACHE_TTL,
+                 memory_entries: int = LLM_CACHE_MEMORY_ENTRIES, disk_bytes: int = LLM_CACHE_DISK_BYTES):
+        self.directory = directory
+        self.ttl = ttl
+        self.memory_entries = memory_entries
+        self.disk_bytes = disk_bytes
+        self.memory = OrderedDict()
+        self.lock = threading.Lock()
+        # Bytes on disk, kept up to date on writes so only an overflow rescans the directory
+        self.disk_used = 0
+        self.evicting = threading.Lock()
+        self.counters = {
+            "memory_hits": 0,
+            "disk_hits": 0,
+            "misses": 0,
+            "bypassed": 0,
+            "saved_seconds": 0.0,
+            "saved_prompt_tokens": 0,
+            "saved_completion_tokens": 0,
+        }
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+            self._evict_disk()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.json")
+
+    def _expired(self, entry: dict) -> bool:
+        return self.ttl > 0 and time.time() - entry.get("created", 0) > self.ttl
+
+    def _remember(self, key: str, entry: dict):
+        self.memory[key] = entry
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.memory_entries:
+            self.memory.popitem(last=False)
+
+    def _record_hit(self, tier: str, entry: dict):
+        usage = entry.get("usage") or {}
+        self.counters[f"{tier}_hits"] += 1
+        self.counters["saved_seconds"] += entry.get("elapsed", 0.0)
+        self.counters["saved_prompt_tokens"] += usage.get("prompt_tokens", 0)
+        self.counters["saved_completion_tokens"] += usage.get("completion_tokens", 0)
+
+    def get(self, key: str):
+        with self.lock:
+            entry = self.memory.get(key)
+            if entry is not None:
+                if self._expired(entry):
+                    del self.memory[key]
+                else:
+                    self.memory.move_to_end(key)
+                    self._record_hit("memory", entry)
+                    return entry
+            entry = self._read_disk(key)
+            if entry is not None:
+                self._remember(key, entry)
+                self._record_hit("disk", entry)
+                return entry
+            self.counters["misses"] += 1
+            return None
+
+    def put(self, key: str, content: str, usage: dict = None, elapsed: float = 0.0) -> dict:
+        entry = {"content": content, "usage": usage or {}, "elapsed": elapsed, "created": time.time()}
+        with self.lock:
+            self._remember(key, entry)
+        # Outside the lock: gets shouldn't wait on file writes, let alone an eviction scan
+        self._write_disk(key, entry)
+        return entry
+
+    def record_bypass(self):
+        with self.lock:
+            self.counters["bypassed"] += 1
+
+    def stats(self) -> dict:
+        with self.lock:
+            stats = dict(self.counters)
+            stats["memory_entries"] = len(self.memory)
+        hits = stats["memory_hits"] + stats["disk_hits"]
+        lookups = hits + stats["misses"]
+        stats["hit_ratio"] = round(hits / lookups, 4) if lookups else 0.0
+        stats["saved_seconds"] = round(stats["saved_seconds"], 3)
+        return stats
+
+    def _read_disk(self, key: str):
+        if not self.directory:
+            return None
+        path = self._path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if self._expired(entry):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            return None
+        try:
+            # Touch so disk eviction drops the least recently used files first
+            os.utime(path)
+        except OSError:
+            pass
+        return entry
+
+    def _write_disk(self, key: str, entry: dict):
+        if not self.directory:
+            return
+        path = self._path(key)
+        tmp = f"{path}.{threading.get_ident()}.tmp"
+        try:
+            old_size = os.path.getsize(path)
+        except OSError:
+            old_size = 0
+        try:
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(entry, f, ensure_ascii=False)
+            size = os.path.getsize(tmp)
+            os.replace(tmp, path)
+        except OSError as e:
+            print(f"LLM cache write failed for {key}: {e}")
+            return
+        with self.lock:
+            self.disk_used += size - old_size
+            over = self.disk_used > self.disk_bytes
+        if over:
+            self._evict_disk()
+
+    def _evict_disk(self):
+        """
+        Drop expired files, then the oldest ones until the directory fits the size
+        limit, and recount disk_used. One scan at a time; others skip it.
+        """
+        if not self.evicting.acquire(blocking=False):
+            return
+        try:
+            self._scan_disk()
+        finally:
+            self.evicting.release()
+
+    def _scan_disk(self):
+        files = []
+        total = 0
+        now = time.time()
+        with os.scandir(self.directory) as it:
+            for e in it:
+                if not e.name.endswith(".json"):
+                    continue
+                st = e.stat()
+                if self.ttl > 0 and now - st.st_mtime > self.ttl:
+                    try:
+                        os.remove(e.path)
+                    except OSError:
+                        pass
+                    continue
+                files.append((st.st_mtime, st.st_size, e.path))
+                total += st.st_size
+        files.sort()
+        for _, size, path in files:
+            if total <= self.disk_bytes:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
+        with self.lock:
+            self.disk_used = total
+
+
+llm_cache = LLMCache()
@@ -0,0 +1,242 @@
+import os
+import time
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, CancelledError, wait, FIRST_COMPLETED
+
+from jobs import bind_job, log
+import metrics
+
+LLM_MODEL = os.getenv("LLM_MODEL", "gpt-4o")
+# Cheaper model for small prompts and LLM_FAST_KINDS, e.g. gpt-4o-mini; empty (the
+# default) disables routing and every call goes to LLM_MODEL
+LLM_FAST_MODEL = os.getenv("LLM_FAST_MODEL", "")
+# Prompts up to this many tokens go to the fast model
+LLM_FAST_MAX_PROMPT_TOKENS = int(os.getenv("LLM_FAST_MAX_PROMPT_TOKENS", "1500"))
+# Kinds of call always sent to the fast model ("edit" is round 2's SEARCH/REPLACE replies)
+LLM_FAST_KINDS = tuple(k.strip() for k in os.getenv("LLM_FAST_KINDS", "edit").split(",") if k.strip())
+# While the fast model fails more often than this, small calls go to LLM_MODEL instead
+LLM_FAST_MAX_ERROR_RATE = float(os.getenv("LLM_FAST_MAX_ERROR_RATE", "0.2"))
+# Upper bound on one call asking for up to LLM_DEADLINE_TOKENS, streaming included;
+# calls asking for more get proportionally longer
+LLM_DEADLINE = float(os.getenv("LLM_DEADLINE", "180"))
+LLM_DEADLINE_TOKENS = int(os.getenv("LLM_DEADLINE_TOKENS", "4000"))
+# A call still running past this percentile of the latency of like calls (same model,
+# kind and max_tokens bucket) gets a second copy; 0 disables
+LLM_HEDGE_PERCENTILE = float(os.getenv("LLM_HEDGE_PERCENTILE", "95"))
+LLM_HEDGE_MIN_SAMPLES = int(os.getenv("LLM_HEDGE_MIN_SAMPLES", "20"))
+STATS_WINDOW = 200
+
+
+def call_shape(kind: str, max_tokens: int) -> tuple:
+    """
+    Which calls' latencies are comparable: same kind, max_tokens in the same power of two.
+    """
+    return kind, 1 << max(int(max_tokens or 1) - 1, 1).bit_length()
+
+
+def call_deadline(max_tokens: int) -> float:
+    return LLM_DEADLINE * max((max_tokens or 0) / LLM_DEADLINE_TOKENS, 1.0)
+
+
+class LLMCall:
+    """
+    Handle on one in-flight request, so a hedge or deadline can cancel it.
+    stream_completion stores its response here and stops once cancelled is set.
+    """
+
+    def __init__(self):
+        self.cancelled = threading.Event()
+        self.response = None
+        self.started = time.perf_counter()
+
+    def cancel(self):
+        self.cancelled.set()
+        response = self.response
+        if response is not None:
+            # Unblocks a read in progress on the worker thread
+            response.close()
+
+
+class ModelStats:
+    """
+    Recent latencies and outcomes of one model, plus token totals. Successful
+    latencies are also kept per call shape (see call_shape), since a short edit
+    reply and a 16k-token rewrite say little about each other's expected time.
+    """
+
+    def __init__(self, window: int = STATS_WINDOW):
+        self.window = window
+        self.samples = deque(maxlen=window)
+        self.shapes = {}
+        self.counters = {"requests": 0, "errors": 0, "timeouts": 0, "hedged": 0, "hedge_wins": 0,
+                         "prompt_tokens": 0, "completion_tokens": 0}
+        self.lock = threading.Lock()
+
+    def record(self, seconds: float, ok: bool, usage: dict = None, shape: tuple = None):
+        with self.lock:
+            self.samples.append((seconds, ok))
+            if ok and shape is not None:
+                self.shapes.setdefault(shape, deque(maxlen=self.window)).append(seconds)
+            self.counters["requests"] += 1
+            self.counters["errors"] += 0 if ok else 1
+            for name in ("prompt_tokens", "completion_tokens"):
+                self.counters[name] += (usage or {}).get(name) or 0
+
+    def count(self, name: str):
+        with self.lock:
+            self.counters[name] += 1
+
+    def percentile(self, p: float, min_samples: int = LLM_HEDGE_MIN_SAMPLES, shape: tuple = None):
+        with self.lock:
+            if shape is None:
+                latencies = sorted(seconds for seconds, ok in self.samples if ok)
+            else:
+                latencies = sorted(self.shapes.get(shape, ()))
+        if len(latencies) < min_samples:
+            return None
+        return latencies[min(int(len(latencies) * p / 100), len(latencies) - 1)]
+
+    def error_rate(self) -> float:
+        with self.lock:
+            if not self.samples:
+                return 0.0
+            return sum(1 for _, ok in self.samples if not ok) / len(self.samples)
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            stats = dict(self.counters)
+        stats["error_rate"] = round(self.error_rate(), 4)
+        for p in (50, 95):
+            value = self.percentile(p, min_samples=1)
+            stats[f"p{p}_seconds"] = round(value, 3) if value is not None else None
+        return stats
+
+
+class LLMRouter:
+    """
+    Picks the model for each call and runs it with a deadline and hedging.
+    Small prompts and the kinds in LLM_FAST_KINDS go to the fast model unless
+    its recent error rate or p95 says it's currently the worse choice.
+    """
+
+    def __init__(self, model: str = LLM_MODEL, fast_model: str = LLM_FAST_MODEL):
+        self.model = model
+        self.fast_model = fast_model or model
+        self.models = {}
+        self.lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=int(os.getenv("LLM_MAX_CONNECTIONS", "8")) * 2,
+                                           thread_name_prefix="llm")
+
+    def stats(self, model: str) -> ModelStats:
+        with self.lock:
+            stats = self.models.get(model)
+            if stats is None:
+                stats = self.models[model] = ModelStats()
+            return stats
+
+    def choose(self, prompt_tokens: int, kind: str = "write") -> str:
+        if self.fast_model == self.model:
+            return self.model
+        if kind not in LLM_FAST_KINDS and prompt_tokens > LLM_FAST_MAX_PROMPT_TOKENS:
+            return self.model
+        fast = self.stats(self.fast_model)
+        if fast.error_rate() > LLM_FAST_MAX_ERROR_RATE:
+            return self.model
+        fast_p95 = fast.percentile(95)
+        primary_p95 = self.stats(self.model).percentile(95)
+        if fast_p95 is not None and primary_p95 is not None and fast_p95 > primary_p95:
+            return self.model
+        return self.fast_model
+
+    def call(self, fn, model: str, deadline: float = None, cancel: threading.Event = None,
+             kind: str = "write", max_tokens: int = None):
+        """
+        Run fn(call) -> (text, usage, error) within deadline seconds (by default
+        LLM_DEADLINE, scaled up for large max_tokens). If it's still running past
+        the hedge percentile of like calls (same kind and max_tokens bucket), the
+        same request is sent again and whichever finishes first without an error
+        wins; the other is cancelled.
+        Raises TimeoutError past the deadline, or the error if every attempt raised.
+        Setting cancel (the caller no longer wants the result) raises CancelledError.
+        """
+        stats = self.stats(model)
+        shape = call_shape(kind, max_tokens)
+        if deadline is None:
+            deadline = call_deadline(max_tokens)
+        hedge_after = stats.percentile(LLM_HEDGE_PERCENTILE, shape=shape) if LLM_HEDGE_PERCENTILE else None
+        end = time.perf_counter() + deadline
+        calls = {}
+
+        def start():
+            call = LLMCall()
+            calls[self.executor.submit(bind_job(fn), call)] = call
+            return call
+
+        first = start()
+        pending = set(calls)
+        hedged = False
+        fallback = None
+        error = None
+        try:
+            while pending:
+                now = time.perf_counter()
+                if now >= end:
+                    break
+                timeout = end - now
+                if not hedged and hedge_after is not None:
+                    timeout = min(timeout, max(hedge_after - (now - first.started), 0))
+                if cancel is not None:
+                    timeout = min(timeout, 0.25)
+                done, pending = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+                if cancel is not None and cancel.is_set() and pending:
+                    raise CancelledError(f"LLM call to {model} no longer needed")
+                for future in done:
+                    call = calls[future]
+                    elapsed = time.perf_counter() - call.started
+                    try:
+                        result = future.result()
+                    except Exception as e:
+                        stats.record(elapsed, False)
+                        error = error or e
+                        continue
+                    if result[2] is None:
+                        stats.record(elapsed, True, result[1], shape)
+                        if hedged:
+                            winner = "first" if call is first else "hedge"
+                            metrics.llm_hedges_total.inc(model=model, winner=winner)
+                            if winner == "hedge":
+                                stats.count("hedge_wins")
+                        return result
+                    # Rejected by validation; keep it unless a hedge does better
+                    fallback = fallback or result
+                if (not done and not hedged and hedge_after is not None
+                        and time.perf_counter() - first.started >= hedge_after):
+                    log(f"LLM call to {model} past p{LLM_HEDGE_PERCENTILE:g} ({hedge_after:.1f}s), hedging")
+                    hedged = True
+                    stats.count("hedged")
+                    start()
+                    pending = {f for f, c in calls.items() if not f.done()}
+            if fallback is not None:
+                return fallback
+            if error is not None and not pending:
+                raise error
+            stats.record(deadline, False)
+            stats.count("timeouts")
+            raise TimeoutError(f"LLM call to {model} passed its {deadline:g}s deadline")
+        finally:
+            for future, call in calls.items():
+                if not future.done():
+                    call.cancel()
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            models = dict(self.models)
+        return {
+            "model": self.model,
+            "fast_model": self.fast_model,
+            "models": {name: stats.snapshot() for name, stats in models.items()},
+        }
+
+
+llm_router = LLMRouter()
@@ -0,0 +1,187 @@
+import os
+import sys
+import json
+import time
+import base64
+import queue
+import itertools
+import threading
+import subprocess
+
+from attachments import attachment_bytes
+from jobs import log
+import metrics
+
+# Node binary for the checks; jsdom must resolve from this directory (npm install)
+LOCAL_CHECKS_NODE = os.getenv("LOCAL_CHECKS_NODE", "node")
+# Node processes kept running to check pages
+LOCAL_CHECK_WORKERS = int(os.getenv("LOCAL_CHECK_WORKERS", "2"))
+# A page and all its checks get this long, then the worker is killed and replaced
+LOCAL_CHECK_TIMEOUT = float(os.getenv("LOCAL_CHECK_TIMEOUT", "15"))
+# Each check expression gets this long
+LOCAL_CHECK_SCRIPT_TIMEOUT = float(os.getenv("LOCAL_CHECK_SCRIPT_TIMEOUT", "2"))
+# Time for timers and fetches started on load to settle before the checks run
+LOCAL_CHECK_SETTLE = float(os.getenv("LOCAL_CHECK_SETTLE", "0.5"))
+HERE = os.path.dirname(os.path.abspath(__file__))
+CHECK_RUNNER = os.path.join(HERE, "check_runner.js")
+
+
+def file_b64(file: dict) -> str:
+    # Binary attachments are kept as base64 already, send them as they are
+    if file.get("binary", False) and isinstance(file.get("content"), str):
+        return file["content"]
+    return base64.b64encode(attachment_bytes(file)).decode("ascii")
+
+
+class CheckWorker:
+    """
+    One check_runner.js process, fed a page at a time over stdin/stdout.
+    """
+
+    def __init__(self, node: str = LOCAL_CHECKS_NODE):
+        self.process = subprocess.Popen(
+            [node, CHECK_RUNNER], cwd=HERE, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL, text=True, encoding="utf-8")
+        self.replies = queue.Queue()
+        threading.Thread(target=self._read, name="local-checks-reader", daemon=True).start()
+
+    def run(self, request: dict, timeout: float) -> dict:
+        """
+        Raises TimeoutError if the page doesn't finish within timeout seconds
+        (the worker is then unusable), OSError if the process is gone.
+        """
+        self.process.stdin.write(json.dumps(request) + "\n")
+        self.process.stdin.flush()
+        end = time.monotonic() + timeout
+        while True:
+            try:
+                line = self.replies.get(timeout=max(end - time.monotonic(), 0))
+            except queue.Empty:
+                raise TimeoutError(f"page checks took longer than {timeout:g}s")
+            if line is None:
+                raise OSError(f"check runner exited with {self.process.wait()}")
+            reply = json.loads(line)
+            # Anything else would be a stray line, not this page's reply
+            if reply.get("id") == request["id"]:
+                return reply
+
+    def alive(self) -> bool:
+        return self.process.poll() is None
+
+    def close(self):
+        if self.alive():
+            self.process.kill()
+        self.process.wait()
+
+    def _read(self):
+        for line in self.process.stdout:
+            self.replies.put(line)
+        self.replies.put(None)
+
+
+class LocalChecker:
+    """
+    Runs a task's JavaScript checks against a generated page in jsdom, without
+    network access, on a pool of long-lived node workers. Used to reject a
+    candidate page before paying for a push, a Pages build and an evaluation.
+    Disabled (run() returns None) when node or jsdom isn't installed.
+    """
+
+    def __init__(self, workers: int = LOCAL_CHECK_WORKERS, node: str = LOCAL_CHECKS_NODE,
+                 timeout: float = LOCAL_CHECK_TIMEOUT):
+        self.node = node
+        self.timeout = timeout
+        self.slots = threading.BoundedSemaphore(max(workers, 1))
+        self.idle = queue.LifoQueue()
+        self.ids = itertools.count(1)
+        self.lock = threading.Lock()
+        self.available = None
+
+    def enabled(self) -> bool:
+        with self.lock:
+            if self.available is None:
+                self.available = self._probe()
+            return self.available
+
+    def run(self, html: str, checks: list[str], files: list[dict] = ()) -> dict:
+        """
+        Check html against checks; files are the other files being pushed, served
+        to the page's relative URLs. Returns {"passed", "counts", "results",
+        "errors", "unloaded", "seconds"} where passed means no check failed or
+        errored (prose checks are skipped), or None if checking isn't available.
+        """
+        if not checks or not self.enabled():
+            return None
+        request = {
+            "id": next(self.ids),
+            "html": html,
+            "checks": list(checks),
+            "files": {f["name"]: file_b64(f) for f in files if f["name"] != "index.html"},
+            "script_timeout_ms": int(LOCAL_CHECK_SCRIPT_TIMEOUT * 1000),
+            "settle_ms": int(LOCAL_CHECK_SETTLE * 1000),
+        }
+        start = time.perf_counter()
+        with self.slots:
+            worker = self._acquire()
+            try:
+                reply = worker.run(request, self.timeout)
+            except (TimeoutError, OSError, ValueError) as e:
+                worker.close()
+                worker = None
+                reply = {"error": str(e)}
+            finally:
+                if worker is not None:
+                    self.idle.put(worker)
+
+        if reply.get("error"):
+            # The page itself hung or crashed the runner: every check counts as failed
+            results = [{"check": c, "status": "error", "error": reply["error"]} for c in checks]
+            reply = {"results": results, "errors": [reply["error"]], "unloaded": []}
+        counts = {status: 0 for status in ("pass", "fail", "error", "skipped")}
+        for result in reply["results"]:
+            counts[result["status"]] += 1
+        passed = counts["fail"] == 0 and counts["error"] == 0
+        metrics.local_checks_total.inc(outcome="passed" if passed else "failed")
+        return {"passed": passed, "counts": counts, "results": reply["results"],
+                "errors": reply.get("errors", []), "unloaded": reply.get("unloaded", []),
+                "seconds": round(time.perf_counter() - start, 3)}
+
+    def _acquire(self) -> CheckWorker:
+        while True:
+            try:
+                worker = self.idle.get_nowait()
+            except queue.Empty:
+                return CheckWorker(self.node)
+            if worker.alive():
+                return worker
+            worker.close()
+
+    def _probe(self) -> bool:
+        try:
+            subprocess.run([self.node, "-e", "require.resolve('jsdom')"], cwd=HERE, check=True,
+                           stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, timeout=30)
+        except (OSError, subprocess.SubprocessError) as e:
+            log(f"Local checks disabled, needs node with jsdom ({self.node}: {e})")
+            return False
+        return True
+
+
+local_checker = LocalChecker()
+
+
+if __name__ == "__main__":
+    # python local_checks.py index.html task.json: check a page against a task's checks
+    with open(sys.argv[1], encoding="utf-8") as f:
+        page = f.read()
+    with open(sys.argv[2], encoding="utf-8") as f:
+        task = json.load(f)
+    report = local_checker.run(page, task.get("checks", []))
+    if report is None:
+        sys.exit("Local checks are unavailable (no checks, or node/jsdom missing)")
+    for result in report["results"]:
+        print(f"{result['status']:8} {result['check']}" + (f"  ({result['error']})" if result["error"] else ""))
+    for error in report["errors"]:
+        print(f"page error: {error}")
+    for url in report["unloaded"]:
+        print(f"not loaded: {url}")
+    sys.exit(0 if report["passed"] else 1)
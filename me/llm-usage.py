@@ -4,14 +4,16 @@
 #   "requests"
 # ]
 # ///
-import requests, os
+import requests, os, sys, time
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from llm_cache import llm_cache, cache_key
 
 # use this proxy https://aipipe.org/openai/v1 to send a request to open ai api with model gpt o4 mini
 API_URL = "https://aipipe.org/openai/v1/chat/completions"
 API_KEY = os.getenv("AIAPI_KEY")
 
 
-def generate_code(prompt: str) -> str:    
+def generate_code(prompt: str, use_cache: bool = True) -> str:    
     headers = {
         "Content-Type": "application/json",
         "Authorization": f"Bearer {API_KEY}"
@@ -24,10 +26,18 @@ def generate_code(prompt: str) -> str:
         "max_tokens": 1000,
         "temperature": 0.7
     }
+    key = cache_key(json_data)
+    cached = llm_cache.get(key) if use_cache else None
+    if cached is not None:
+        return cached["content"]
+    start = time.perf_counter()
     response = requests.post(API_URL, headers=headers, json=json_data)    
     os.getenv("AIAPI_KEY")
     if response.status_code == 200:
-        return response.json()['choices'][0]['message']['content']
+        body = response.json()
+        content = body['choices'][0]['message']['content']
+        llm_cache.put(key, content, body.get("usage"), time.perf_counter() - start)
+        return content
     else:
         raise Exception(f"Request failed with status code {response.status_code}: {response.text}")
     
@@ -0,0 +1,122 @@
+import bisect
+import threading
+
+# Seconds; covers quick GitHub reads up to slow LLM generations
+DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels_text(names: tuple, values: tuple, extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labels: tuple = ()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(str(labels.get(n, "")) for n in self.labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self.lock:
+            for key, value in sorted(self.values.items()):
+                lines.append(f"{self.name}{_labels_text(self.labels, key)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, labels: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = tuple(sorted(buckets))
+        self.series = {}
+        self.lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = tuple(str(labels.get(n, "")) for n in self.labels)
+        with self.lock:
+            series = self.series.get(key)
+            if series is None:
+                series = {"counts": [0] * (len(self.buckets) + 1), "sum": 0.0, "count": 0}
+                self.series[key] = series
+            series["counts"][bisect.bisect_left(self.buckets, value)] += 1
+            series["sum"] += value
+            series["count"] += 1
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self.lock:
+            for key, series in sorted(self.series.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets + (float("inf"),), series["counts"]):
+                    cumulative += count
+                    le = "+Inf" if bound == float("inf") else repr(float(bound))
+                    labels = _labels_text(self.labels, key, f'le="{le}"')
+                    lines.append(f"{self.name}_bucket{labels} {cumulative}")
+                labels = _labels_text(self.labels, key)
+                lines.append(f"{self.name}_sum{labels} {series['sum']}")
+                lines.append(f"{self.name}_count{labels} {series['count']}")
+        return lines
+
+
+stage_seconds = Histogram(
+    "pipeline_stage_seconds", "Time spent in each pipeline stage", ("stage",))
+stage_total = Counter(
+    "pipeline_stage_total", "Pipeline stages run, by outcome", ("stage", "outcome"))
+upstream_seconds = Histogram(
+    "upstream_request_seconds", "Latency of upstream HTTP calls", ("upstream", "method", "status"))
+upstream_total = Counter(
+    "upstream_requests_total", "Upstream HTTP calls by status and retry attempt",
+    ("upstream", "method", "status", "retry"))
+jobs_total = Counter(
+    "jobs_total", "Jobs finished, by round and status", ("round", "status"))
+llm_ttft_seconds = Histogram(
+    "llm_time_to_first_token_seconds", "Time until the first streamed LLM token", ("model",))
+llm_stream_seconds = Histogram(
+    "llm_stream_seconds", "Total time of completed LLM streams", ("model",))
+llm_streams_cancelled_total = Counter(
+    "llm_streams_cancelled_total", "LLM streams cancelled by early validation", ("model", "reason"))
+prompt_tokens_saved_total = Counter(
+    "prompt_tokens_saved_total", "Estimated input tokens saved by condensing attachments")
+llm_hedges_total = Counter(
+    "llm_hedges_total", "Hedged LLM calls, by which request finished first", ("model", "winner"))
+repo_pool_claims_total = Counter(
+    "repo_pool_claims_total", "Round-1 repos taken from the warm pool (hit) or bootstrapped (miss)",
+    ("outcome",))
+pages_ready_seconds = Histogram(
+    "pages_ready_seconds", "Time from push until Pages served the commit, by outcome", ("outcome",),
+    buckets=(5, 10, 20, 30, 45, 60, 90, 120, 180, 300, 600))
+evaluation_callbacks_total = Counter(
+    "evaluation_callbacks_total", "Evaluation callback delivery attempts, by outcome", ("outcome",))
+local_checks_total = Counter(
+    "local_checks_total", "Pages checked locally against the task's checks, by outcome", ("outcome",))
+llm_candidates_total = Counter(
+    "llm_candidates_total", "Speculative round candidates generated, by what became of them", ("outcome",))
+admission_rejections_total = Counter(
+    "admission_rejections_total", "Tasks refused with a 429 at admission, by reason", ("reason",))
+
+REGISTRY = [stage_seconds, stage_total, upstream_seconds, upstream_total, jobs_total,
+            llm_ttft_seconds, llm_stream_seconds, llm_streams_cancelled_total, llm_hedges_total,
+            prompt_tokens_saved_total, repo_pool_claims_total, pages_ready_seconds, evaluation_callbacks_total,
+            local_checks_total, llm_candidates_total, admission_rejections_total]
+
+
+def render() -> str:
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
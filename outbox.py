@@ -0,0 +1,212 @@
+import os
+import json
+import time
+import random
+import sqlite3
+import threading
+from urllib.parse import urlsplit
+from concurrent.futures import ThreadPoolExecutor
+
+from http_client import evaluation
+from job_store import JOB_DB_PATH
+from jobs import log
+import metrics
+
+OUTBOX_DB_PATH = os.getenv("OUTBOX_DB_PATH", JOB_DB_PATH)
+# Callbacks in flight to one evaluation host at a time
+EVALUATION_MAX_PER_HOST = int(os.getenv("EVALUATION_MAX_PER_HOST", "2"))
+EVALUATION_SENDERS = int(os.getenv("EVALUATION_SENDERS", "8"))
+# How long a callback keeps being retried after it was queued
+EVALUATION_DEADLINE = float(os.getenv("EVALUATION_DEADLINE", "600"))
+BACKOFF_BASE = 1.0
+BACKOFF_MAX = 60.0
+# 4xx answers that are worth retrying; any other 4xx fails the callback for good
+RETRY_STATUSES = (408, 425, 429)
+
+
+class EvaluationOutbox:
+    """
+    Evaluation callbacks written to SQLite and delivered by background senders,
+    so pipelines finish as soon as the commit exists. Each callback is retried
+    with jittered exponential backoff until it gets a 2xx or its deadline passes;
+    pending ones are picked up again after a restart. At most max_per_host
+    callbacks are in flight per evaluation host, over that host's keep-alive pool.
+    A callback can be queued "held" until something (the Pages tracker) releases it.
+    """
+
+    def __init__(self, path: str = OUTBOX_DB_PATH, max_per_host: int = EVALUATION_MAX_PER_HOST,
+                 senders: int = EVALUATION_SENDERS, deadline: float = EVALUATION_DEADLINE):
+        self.max_per_host = max_per_host
+        self.deadline = deadline
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.lock = threading.Lock()
+        with self.lock, self.conn:
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS callbacks (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    job_id TEXT,
+                    url TEXT NOT NULL,
+                    host TEXT NOT NULL,
+                    payload TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    created_at REAL NOT NULL,
+                    next_attempt_at REAL NOT NULL,
+                    deadline_at REAL NOT NULL,
+                    delivered_at REAL,
+                    response_status INTEGER,
+                    last_error TEXT
+                )
+                """
+            )
+            self.conn.execute(
+                "CREATE INDEX IF NOT EXISTS callbacks_pending ON callbacks (status, next_attempt_at)")
+            self.conn.execute("CREATE INDEX IF NOT EXISTS callbacks_job ON callbacks (job_id)")
+            # Whatever was holding these (a Pages watch) didn't survive the restart
+            self.conn.execute("UPDATE callbacks SET status = 'pending' WHERE status = 'held'")
+        self.executor = ThreadPoolExecutor(max_workers=senders, thread_name_prefix="outbox")
+        self.active = set()
+        self.inflight = {}
+        self.wakeup = threading.Event()
+        threading.Thread(target=self._dispatch, name="outbox-dispatch", daemon=True).start()
+
+    def enqueue(self, job_id: str, url: str, payload: dict, hold: bool = False) -> int:
+        """
+        With hold, the callback waits for release() before it's sent.
+        """
+        now = time.time()
+        with self.lock, self.conn:
+            cursor = self.conn.execute(
+                """
+                INSERT INTO callbacks (job_id, url, host, payload, status, created_at, next_attempt_at, deadline_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                """,
+                (job_id, url, urlsplit(url).netloc, json.dumps(payload), "held" if hold else "pending",
+                 now, now, now + self.deadline),
+            )
+        self.wakeup.set()
+        return cursor.lastrowid
+
+    def release(self, callback_id: int):
+        now = time.time()
+        with self.lock, self.conn:
+            self.conn.execute(
+                """
+                UPDATE callbacks SET status = 'pending', next_attempt_at = ?, deadline_at = ?
+                WHERE id = ? AND status = 'held'
+                """,
+                (now, now + self.deadline, callback_id),
+            )
+        self.wakeup.set()
+
+    def deliveries(self, job_id: str) -> list[dict]:
+        """
+        Delivery state of every callback queued by a job.
+        """
+        with self.lock:
+            rows = self.conn.execute(
+                """
+                SELECT id, url, status, attempts, created_at, delivered_at, response_status, last_error, payload
+                FROM callbacks WHERE job_id = ? ORDER BY id
+                """,
+                (job_id,),
+            ).fetchall()
+        return [
+            {"id": r[0], "url": r[1], "status": r[2], "attempts": r[3], "created_at": r[4],
+             "delivered_at": r[5], "response_status": r[6], "last_error": r[7],
+             "commit_sha": json.loads(r[8]).get("commit_sha")}
+            for r in rows
+        ]
+
+    def pending(self, job_ids=None) -> int:
+        """
+        Callbacks not yet delivered or given up on, optionally only those of job_ids.
+        """
+        with self.lock:
+            rows = self.conn.execute("SELECT job_id FROM callbacks WHERE status IN ('held', 'pending')").fetchall()
+        if job_ids is None:
+            return len(rows)
+        return sum(1 for (job_id,) in rows if job_id in job_ids)
+
+    def _dispatch(self):
+        while True:
+            self.wakeup.clear()
+            now = time.time()
+            with self.lock:
+                rows = self.conn.execute(
+                    """
+                    SELECT id, job_id, url, host, payload, attempts, deadline_at FROM callbacks
+                    WHERE status = 'pending' AND next_attempt_at <= ? ORDER BY next_attempt_at LIMIT 200
+                    """,
+                    (now,),
+                ).fetchall()
+                due = self.conn.execute(
+                    "SELECT MIN(next_attempt_at) FROM callbacks WHERE status = 'pending' AND next_attempt_at > ?",
+                    (now,),
+                ).fetchone()[0]
+                for row in rows:
+                    callback_id, host = row[0], row[3]
+                    if callback_id in self.active or self.inflight.get(host, 0) >= self.max_per_host:
+                        continue
+                    self.active.add(callback_id)
+                    self.inflight[host] = self.inflight.get(host, 0) + 1
+                    self.executor.submit(self._deliver, *row)
+            self.wakeup.wait(min(max(due - now, 0.05), 5.0) if due is not None else 5.0)
+
+    def _deliver(self, callback_id, job_id, url, host, payload, attempts, deadline_at):
+        attempt = attempts + 1
+        try:
+            error, response_status, retry_after = None, None, None
+            try:
+                response = evaluation(url).post(url, data=payload, headers={"Content-Type": "application/json"},
+                                                retry=attempts)
+                response_status = response.status_code
+                if 200 <= response.status_code < 300:
+                    self._update(callback_id, "delivered", attempt, delivered_at=time.time(),
+                                 response_status=response_status)
+                    metrics.evaluation_callbacks_total.inc(outcome="delivered")
+                    log(f"Evaluation callback {callback_id} for job {job_id} delivered after {attempt} attempt(s)")
+                    return
+                error = f"{response.status_code} - {response.text[:200]}"
+                retry_after = response.headers.get("Retry-After")
+                if 400 <= response.status_code < 500 and response.status_code not in RETRY_STATUSES:
+                    self._fail(callback_id, job_id, attempt, error, response_status)
+                    return
+            except Exception as e:
+                error = f"{type(e).__name__}: {e}"
+
+            delay = random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempts))
+            if retry_after is not None:
+                try:
+                    delay = max(delay, float(retry_after))
+                except ValueError:
+                    pass
+            next_attempt = time.time() + delay
+            if next_attempt > deadline_at:
+                self._fail(callback_id, job_id, attempt, f"deadline passed, last error: {error}", response_status)
+                return
+            self._update(callback_id, "pending", attempt, next_attempt_at=next_attempt,
+                         response_status=response_status, last_error=error)
+            metrics.evaluation_callbacks_total.inc(outcome="retried")
+            log(f"Evaluation callback {callback_id} for job {job_id} failed ({error}), retrying in {delay:.1f}s")
+        finally:
+            with self.lock:
+                self.active.discard(callback_id)
+                self.inflight[host] -= 1
+            self.wakeup.set()
+
+    def _fail(self, callback_id, job_id, attempt, error, response_status):
+        self._update(callback_id, "failed", attempt, response_status=response_status, last_error=error)
+        metrics.evaluation_callbacks_total.inc(outcome="failed")
+        log(f"Evaluation callback {callback_id} for job {job_id} failed for good: {error}")
+
+    def _update(self, callback_id, status, attempts, **fields):
+        fields.update(status=status, attempts=attempts)
+        columns = ", ".join(f"{name} = ?" for name in fields)
+        with self.lock, self.conn:
+            self.conn.execute(f"UPDATE callbacks SET {columns} WHERE id = ?", (*fields.values(), callback_id))
+
+
+outbox = EvaluationOutbox()
@@ -0,0 +1,139 @@
+import os
+import time
+import heapq
+import itertools
+import threading
+from collections import OrderedDict
+
+from jobs import log
+import metrics
+
+# Hold evaluation callbacks until Pages has built the pushed commit
+PAGES_WAIT = os.getenv("PAGES_WAIT", "1") not in ("0", "false", "")
+# Callbacks are released after this long even if the build never shows up
+PAGES_READY_DEADLINE = float(os.getenv("PAGES_READY_DEADLINE", "300"))
+PAGES_POLL_WORKERS = int(os.getenv("PAGES_POLL_WORKERS", "2"))
+PAGES_POLL_MIN = 2.0
+PAGES_POLL_MAX = 30.0
+PAGES_STATS_REPOS = 512
+
+
+class PagesTracker:
+    """
+    Watches GitHub Pages builds until a pushed commit is live, then calls the
+    watch's on_ready (which releases the held evaluation callback).
+    All watches share one schedule served by a few poll workers. The first poll
+    comes just before a typical recent build would finish, later ones back off
+    from PAGES_POLL_MIN up to PAGES_POLL_MAX; the GETs go through the
+    scheduler's ETag cache, so unchanged build status costs a 304. A build of a
+    later commit pushed to the same repo settles the earlier watches too, since
+    the page then shows at least their commit.
+    fetch_build(repo) returns the latest build ({"status", "commit", ...}) or None.
+    """
+
+    def __init__(self, fetch_build, workers: int = PAGES_POLL_WORKERS, deadline: float = PAGES_READY_DEADLINE):
+        self.fetch_build = fetch_build
+        self.deadline = deadline
+        self.schedule = []
+        self.order = itertools.count()
+        self.pushed = {}
+        self.repos = OrderedDict()
+        self.recent = []
+        self.lock = threading.Condition()
+        for i in range(workers):
+            threading.Thread(target=self._work, name=f"pages-{i}", daemon=True).start()
+
+    def watch(self, repo_name: str, commit_sha: str, on_ready):
+        now = time.time()
+        watch = {"repo": repo_name, "commit": commit_sha, "on_ready": on_ready, "started": now,
+                 "deadline": now + self.deadline, "interval": PAGES_POLL_MIN, "done": False}
+        with self.lock:
+            self.pushed.setdefault(repo_name, []).append(watch)
+            self._push(watch, now + self._first_wait())
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                "watching": sum(len(watches) for watches in self.pushed.values()),
+                "recent_build_seconds": round(self._median(), 2) if self.recent else None,
+                "repos": {name: dict(stats) for name, stats in self.repos.items()},
+            }
+
+    def _median(self) -> float:
+        return sorted(self.recent)[len(self.recent) // 2]
+
+    def _first_wait(self) -> float:
+        # Just short of a typical build, then poll more often from there
+        if not self.recent:
+            return PAGES_POLL_MIN
+        return max(self._median() * 0.8, PAGES_POLL_MIN)
+
+    def _push(self, watch: dict, when: float):
+        heapq.heappush(self.schedule, (when, next(self.order), watch))
+        self.lock.notify()
+
+    def _work(self):
+        while True:
+            with self.lock:
+                while not self.schedule or self.schedule[0][0] > time.time():
+                    self.lock.wait(self.schedule[0][0] - time.time() if self.schedule else None)
+                _, _, watch = heapq.heappop(self.schedule)
+                if watch["done"]:
+                    # Settled by a poll for a later commit to the same repo
+                    continue
+            self._poll(watch)
+
+    def _poll(self, watch: dict):
+        repo_name = watch["repo"]
+        try:
+            build = self.fetch_build(repo_name)
+        except Exception as e:
+            log(f"Pages build status for {repo_name} failed: {e}")
+            build = None
+        now = time.time()
+        settled, outcome = [], None
+        with self.lock:
+            if watch["done"]:
+                return
+            # Watches of this repo in push order; a build of this or any later commit settles up to it
+            pushed = self.pushed.get(repo_name, [])
+            if build is not None and build.get("status") in ("built", "errored"):
+                later = [w["commit"] for w in pushed[pushed.index(watch):]]
+                if build.get("commit") in later:
+                    outcome = "built" if build["status"] == "built" else "errored"
+                    last = pushed.index(watch) + later.index(build["commit"])
+                    settled, pushed[:last + 1] = pushed[:last + 1], []
+            if outcome is None and now >= watch["deadline"]:
+                outcome = "timeout"
+                settled = [watch]
+                pushed.remove(watch)
+            if outcome is None:
+                watch["interval"] = min(watch["interval"] * 1.5, PAGES_POLL_MAX)
+                self._push(watch, min(now + watch["interval"], watch["deadline"]))
+                return
+            if not pushed:
+                self.pushed.pop(repo_name, None)
+            for w in settled:
+                w["done"] = True
+                self._record(w, outcome, now - w["started"], timed=w is watch)
+        for w in settled:
+            elapsed = now - w["started"]
+            metrics.pages_ready_seconds.observe(elapsed, outcome=outcome)
+            log(f"Pages for {repo_name}@{w['commit'][:7]}: {outcome} after {elapsed:.1f}s")
+            try:
+                w["on_ready"]()
+            except Exception as e:
+                log(f"Releasing the callback for {repo_name} failed: {e}")
+
+    def _record(self, watch: dict, outcome: str, elapsed: float, timed: bool):
+        if outcome == "built" and timed:
+            self.recent = (self.recent + [elapsed])[-50:]
+        stats = self.repos.pop(watch["repo"], None) or {"builds": 0, "timeouts": 0, "errors": 0}
+        stats["builds"] += outcome == "built"
+        stats["timeouts"] += outcome == "timeout"
+        stats["errors"] += outcome == "errored"
+        stats["last_seconds"] = round(elapsed, 2)
+        stats["last_outcome"] = outcome
+        self.repos[watch["repo"]] = stats
+        while len(self.repos) > PAGES_STATS_REPOS:
+            self.repos.popitem(last=False)
@@ -0,0 +1,259 @@
+import os
+import io
+import re
+import csv
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+
+from attachments import describe_attachment, repo_path
+from jobs import current_job, log
+import metrics
+
+# Input tokens a whole prompt may use; attachments get what the rest leaves over
+PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", "12000"))
+# A condensed attachment never gets less than this, even when the budget is spent
+MIN_ATTACHMENT_TOKENS = int(os.getenv("MIN_ATTACHMENT_TOKENS", "200"))
+COMPACT_CACHE_ENTRIES = int(os.getenv("COMPACT_CACHE_ENTRIES", "256"))
+# Placeholder the prompt builders leave where the attachments go
+ATTACHMENTS_SLOT = "\0attachments\0"
+SAMPLE_ROWS = 5
+TAIL_ROWS = 2
+# Text past this size is counted on a sample and extrapolated
+COUNT_SAMPLE_CHARS = 256 * 1024
+
+# Roughly how BPE tokenizers split text: words, runs of up to 3 digits, single symbols
+_PIECE = re.compile(r"[A-Za-z]+|\d{1,3}|[^\sA-Za-z\d]")
+
+
+def count_tokens(text: str) -> int:
+    """
+    Local estimate of the token count, close enough to budget with and
+    without a tokenizer dependency.
+    """
+    if len(text) <= COUNT_SAMPLE_CHARS:
+        return len(_PIECE.findall(text))
+    sample = len(_PIECE.findall(text[:COUNT_SAMPLE_CHARS]))
+    return sample * len(text) // COUNT_SAMPLE_CHARS
+
+
+def clip(text: str, limit: int) -> str:
+    """
+    Cut text down to about limit tokens, keeping its start and end.
+    """
+    tokens = count_tokens(text)
+    if tokens <= limit:
+        return text
+    keep = max(int(len(text) * limit / tokens) - 40, 0)
+    head = text[:keep * 3 // 4]
+    tail = text[len(text) - keep // 4:] if keep // 4 else ""
+    return f"{head}\n... [{len(text) - len(head) - len(tail)} characters omitted] ...\n{tail}"
+
+
+def attachment_kind(file: dict) -> str:
+    name = file["name"].lower()
+    mime = file.get("mime") or ""
+    if mime in ("text/csv", "application/csv", "text/tab-separated-values") or name.endswith((".csv", ".tsv")):
+        return "table"
+    if mime == "application/json" or mime.endswith("+json") or name.endswith((".json", ".geojson")):
+        return "json"
+    return "text"
+
+
+def _value_type(value: str) -> str:
+    if value == "":
+        return "empty"
+    for kind, parse in (("int", int), ("float", float)):
+        try:
+            parse(value)
+            return kind
+        except ValueError:
+            pass
+    if value.lower() in ("true", "false"):
+        return "bool"
+    if re.fullmatch(r"\d{4}-\d{2}-\d{2}([T ][\d:.]+Z?)?", value):
+        return "date"
+    return "str"
+
+
+def condense_table(text: str) -> str:
+    """
+    Schema (column types, ranges, example values) plus the first and last rows.
+    """
+    first_line = text[:text.find("\n")] if "\n" in text else text
+    delimiter = "\t" if first_line.count("\t") > first_line.count(",") else ","
+    reader = csv.reader(io.StringIO(text), delimiter=delimiter)
+    header = next(reader, [])
+    columns = [{"types": set(), "min": None, "max": None, "examples": []} for _ in header]
+    head, tail, rows = [], [], 0
+    for row in reader:
+        if not row:
+            continue
+        rows += 1
+        if len(head) < SAMPLE_ROWS:
+            head.append(row)
+        else:
+            tail = (tail + [row])[-TAIL_ROWS:]
+        for column, value in zip(columns, row):
+            kind = _value_type(value.strip())
+            column["types"].add(kind)
+            if kind in ("int", "float"):
+                number = float(value)
+                column["min"] = number if column["min"] is None else min(column["min"], number)
+                column["max"] = number if column["max"] is None else max(column["max"], number)
+            elif len(column["examples"]) < 3 and value not in column["examples"]:
+                column["examples"].append(value[:40])
+
+    lines = [f"Table with {rows} rows and {len(header)} columns (delimiter {delimiter!r}). Columns:"]
+    for name, column in zip(header, columns):
+        types = column["types"] - {"empty"}
+        kind = "float" if types == {"int", "float"} else "/".join(sorted(types)) or "empty"
+        detail = f"{column['min']:g}..{column['max']:g}" if column["min"] is not None else \
+            ", ".join(repr(e) for e in column["examples"])
+        lines.append(f"- {name}: {kind}{' (has blanks)' if 'empty' in column['types'] else ''}"
+                     f"{': ' + detail if detail else ''}")
+    out = io.StringIO()
+    writer = csv.writer(out, delimiter=delimiter, lineterminator="\n")
+    writer.writerow(header)
+    writer.writerows(head)
+    sample = out.getvalue()
+    if tail:
+        out = io.StringIO()
+        csv.writer(out, delimiter=delimiter, lineterminator="\n").writerows(tail)
+        sample += f"... {rows - len(head) - len(tail)} rows omitted ...\n{out.getvalue()}"
+    summary = "\n".join(lines)
+    return f"{summary}\nSample rows:\n{sample}"
+
+
+JSON_TYPES = {"dict": "object", "list": "array", "str": "string", "int": "number", "float": "number",
+              "bool": "boolean", "NoneType": "null"}
+
+
+def _outline(value, path: str, lines: list, depth: int = 0):
+    if len(lines) >= 60:
+        return
+    if isinstance(value, dict):
+        lines.append(f"{path}: object with {len(value)} keys")
+        if depth < 4:
+            for key, item in list(value.items())[:25]:
+                _outline(item, f"{path}.{key}", lines, depth + 1)
+    elif isinstance(value, list):
+        kinds = sorted({JSON_TYPES[type(item).__name__] for item in value[:100]})
+        lines.append(f"{path}: array[{len(value)}] of {'/'.join(kinds) or 'nothing'}")
+        if value and depth < 4:
+            _outline(value[0], f"{path}[]", lines, depth + 1)
+    else:
+        lines.append(f"{path}: {JSON_TYPES[type(value).__name__]} (e.g. {json.dumps(value)[:40]})")
+
+
+def condense_json(text: str) -> str:
+    """
+    Structure outline (keys, types, array lengths) plus the start of the document.
+    """
+    try:
+        value = json.loads(text)
+    except ValueError:
+        return condense_text(text)
+    lines = []
+    _outline(value, "$", lines)
+    if isinstance(value, list):
+        sample = json.dumps(value[:2], indent=1, ensure_ascii=False)
+    else:
+        sample = json.dumps(value, indent=1, ensure_ascii=False)[:2000]
+    summary = "\n".join(lines)
+    return f"JSON structure:\n{summary}\nStart of the document:\n{sample}"
+
+
+def condense_text(text: str) -> str:
+    """
+    First and last lines with the number of lines left out.
+    """
+    lines = text.splitlines()
+    head, tail = lines[:40], lines[-10:] if len(lines) > 50 else []
+    excerpt = "\n".join(head)
+    if tail:
+        excerpt += f"\n... [{len(lines) - 50} lines omitted] ...\n" + "\n".join(tail)
+    return f"{len(lines)} lines. Excerpt:\n{excerpt}"
+
+
+CONDENSERS = {"table": condense_table, "json": condense_json, "text": condense_text}
+
+
+class CompactCache:
+    """
+    Condensed forms of attachments keyed by (content hash, kind), so the same
+    file sent again (or in every subround) is summarised once. The summary is
+    clipped to each prompt's token limit after the lookup, since that limit
+    moves with the rest of the prompt.
+    """
+
+    def __init__(self, max_entries: int = COMPACT_CACHE_ENTRIES):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, text: str, kind: str, limit: int) -> str:
+        key = (hashlib.sha256(text.encode("utf-8")).hexdigest(), kind)
+        with self.lock:
+            compact = self.entries.get(key)
+            if compact is not None:
+                self.entries.move_to_end(key)
+                return clip(compact, limit)
+        compact = CONDENSERS[kind](text)
+        with self.lock:
+            self.entries[key] = compact
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+        return clip(compact, limit)
+
+
+compact_cache = CompactCache()
+
+
+def fill_attachments(prompt: str, attachfiles, empty: str, budget: int = PROMPT_TOKEN_BUDGET) -> str:
+    """
+    Put the attachments into the prompt's ATTACHMENTS_SLOT within the token budget.
+    Binary files are described; text files go in whole while they fit, otherwise
+    the budget left is shared out smallest-first and the rest are condensed.
+    Tokens saved are added to the current job and the metrics.
+    """
+    if not attachfiles:
+        return prompt.replace(ATTACHMENTS_SLOT, empty)
+    parts = [None] * len(attachfiles)
+    texts = []
+    for i, f in enumerate(attachfiles):
+        if f.get("binary", False):
+            parts[i] = describe_attachment({**f, "name": repo_path(f["name"])})
+        else:
+            text = f["content"]
+            texts.append((count_tokens(text), i, f, text))
+    available = budget - count_tokens(prompt.replace(ATTACHMENTS_SLOT, "")) - \
+        sum(count_tokens(p) for p in parts if p is not None)
+
+    saved = 0
+    if sum(tokens for tokens, *_ in texts) <= available:
+        for tokens, i, f, text in texts:
+            parts[i] = f"{f['name']}\n{text}"
+    else:
+        texts.sort(key=lambda item: item[0])
+        for n, (tokens, i, f, text) in enumerate(texts):
+            share = max(available // (len(texts) - n), MIN_ATTACHMENT_TOKENS)
+            if tokens <= share:
+                parts[i] = f"{f['name']}\n{text}"
+                available -= tokens
+                continue
+            compact = compact_cache.get(text, attachment_kind(f), share)
+            parts[i] = (f"{f['name']} (condensed; the full file is committed next to index.html, "
+                        f"load it as ./{repo_path(f['name'])})\n{compact}")
+            used = count_tokens(compact)
+            available -= used
+            saved += tokens - used
+            log(f"Condensed attachment {f['name']}: {tokens} -> {used} tokens")
+
+    if saved:
+        metrics.prompt_tokens_saved_total.inc(saved)
+        job = current_job()
+        if job is not None:
+            job["prompt_tokens_saved"] = job.get("prompt_tokens_saved", 0) + saved
+    return prompt.replace(ATTACHMENTS_SLOT, "\n\n".join(parts))
@@ -0,0 +1,176 @@
+import os
+import time
+import uuid
+import sqlite3
+import threading
+
+from job_store import JOB_DB_PATH
+from jobs import log
+import metrics
+
+# Ready repos to keep on hand; 0 turns the pool off
+REPO_POOL_SIZE = int(os.getenv("REPO_POOL_SIZE", "0"))
+# Repos created per minute at most while refilling
+REPO_POOL_REFILL_PER_MINUTE = float(os.getenv("REPO_POOL_REFILL_PER_MINUTE", "6"))
+# Ready repos unclaimed for this long are deleted and replaced
+REPO_POOL_MAX_AGE = float(os.getenv("REPO_POOL_MAX_AGE", str(30 * 24 * 3600)))
+REPO_POOL_PREFIX = os.getenv("REPO_POOL_PREFIX", "warm-")
+REPO_POOL_DB_PATH = os.getenv("REPO_POOL_DB_PATH", JOB_DB_PATH)
+CLAIM_ATTEMPTS = 3
+
+
+class RepoPool:
+    """
+    Repos created and Pages-enabled ahead of time, so round 1 can rename one
+    to {task}-{nonce} instead of creating it. A background thread keeps `size`
+    repos ready, creating at most refill_per_minute of them, and deletes ready
+    repos nobody claimed within max_age (or more than `size` of them). Repos
+    that fail to delete are marked 'orphaned' and left for manual cleanup.
+    The GitHub calls are passed in: bootstrap(name), rename(old, new) -> status
+    code, delete(name).
+    """
+
+    def __init__(self, bootstrap, rename, delete, size: int = REPO_POOL_SIZE,
+                 refill_per_minute: float = REPO_POOL_REFILL_PER_MINUTE, max_age: float = REPO_POOL_MAX_AGE,
+                 path: str = REPO_POOL_DB_PATH):
+        self.bootstrap = bootstrap
+        self.rename = rename
+        self.delete = delete
+        self.size = size
+        self.interval = 60.0 / refill_per_minute if refill_per_minute > 0 else 60.0
+        self.max_age = max_age
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        with self.lock, self.conn:
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS repo_pool (
+                    name TEXT PRIMARY KEY,
+                    status TEXT NOT NULL,
+                    created_at REAL NOT NULL
+                )
+                """
+            )
+            # A claim cut short by a restart: the rename either happened (and the
+            # next claim gets a 404 and drops the row) or it didn't
+            self.conn.execute("UPDATE repo_pool SET status = 'ready' WHERE status = 'claiming'")
+            # A half-bootstrapped repo isn't worth finishing, delete it instead
+            self.conn.execute("UPDATE repo_pool SET status = 'deleting' WHERE status = 'creating'")
+        if size > 0:
+            threading.Thread(target=self._replenish, name="repo-pool", daemon=True).start()
+
+    def claim(self, repo_name: str) -> bool:
+        """
+        Rename a ready repo to repo_name. False if the pool is empty or the name
+        is taken (a retried task), in which case the caller bootstraps as before.
+        """
+        if self.size <= 0:
+            return False
+        for _ in range(CLAIM_ATTEMPTS):
+            with self.lock, self.conn:
+                row = self.conn.execute(
+                    "SELECT name FROM repo_pool WHERE status = 'ready' ORDER BY created_at LIMIT 1"
+                ).fetchone()
+                if row is None:
+                    break
+                self.conn.execute("UPDATE repo_pool SET status = 'claiming' WHERE name = ?", row)
+            pooled = row[0]
+            try:
+                status = self.rename(pooled, repo_name)
+            except Exception as e:
+                log(f"Renaming pooled repo {pooled} failed: {e}")
+                status = None
+            if status == 200:
+                self._drop(pooled)
+                metrics.repo_pool_claims_total.inc(outcome="hit")
+                log(f"Claimed pooled repo {pooled} as {repo_name}")
+                self.wakeup.set()
+                return True
+            if status == 404:
+                # Gone from GitHub (deleted by hand, or renamed before a restart)
+                self._drop(pooled)
+                continue
+            self._set_status(pooled, "ready")
+            if status == 422:
+                # repo_name already exists: the task ran before
+                break
+            if status is None:
+                break
+        metrics.repo_pool_claims_total.inc(outcome="miss")
+        return False
+
+    def stats(self) -> dict:
+        with self.lock:
+            rows = self.conn.execute("SELECT status, COUNT(*) FROM repo_pool GROUP BY status").fetchall()
+        return {"target": self.size, **dict(rows)}
+
+    def _ready(self) -> list:
+        with self.lock:
+            return self.conn.execute(
+                "SELECT name, created_at FROM repo_pool WHERE status = 'ready' ORDER BY created_at"
+            ).fetchall()
+
+    def _drop(self, name: str):
+        with self.lock, self.conn:
+            self.conn.execute("DELETE FROM repo_pool WHERE name = ?", (name,))
+
+    def _set_status(self, name: str, status: str):
+        with self.lock, self.conn:
+            self.conn.execute("UPDATE repo_pool SET status = ? WHERE name = ?", (status, name))
+
+    def _replenish(self):
+        failures = 0
+        last_created = float("-inf")
+        while True:
+            delay = None
+            try:
+                self._reclaim()
+                if len(self._ready()) < self.size:
+                    # Claims wake this thread up, the refill rate still holds
+                    delay = last_created + self.interval - time.monotonic()
+                    if delay <= 0:
+                        last_created = time.monotonic()
+                        self._create()
+                        delay = self.interval
+                failures = 0
+            except Exception as e:
+                failures += 1
+                delay = min(self.interval * 2 ** failures, 15 * 60)
+                log(f"Repo pool refill failed ({e}), retrying in {delay:.0f}s")
+            # Full pool: sleep until a claim, but look at expiry now and then
+            self.wakeup.wait(delay if delay is not None else min(self.max_age, 3600))
+            self.wakeup.clear()
+
+    def _reclaim(self):
+        ready = self._ready()
+        expired = [name for name, created_at in ready if time.time() - created_at > self.max_age]
+        surplus = [name for name, _ in ready[:max(len(ready) - self.size, 0)]]
+        for name in dict.fromkeys(expired + surplus):
+            self._set_status(name, "deleting")
+        with self.lock:
+            doomed = self.conn.execute("SELECT name FROM repo_pool WHERE status = 'deleting'").fetchall()
+        for (name,) in doomed:
+            try:
+                self.delete(name)
+            except Exception as e:
+                # e.g. a token without delete_repo scope; refilling mustn't wait on it
+                self._set_status(name, "orphaned")
+                log(f"Deleting pooled repo {name} failed, left for manual cleanup: {e}")
+                continue
+            self._drop(name)
+            log(f"Reclaimed unused pooled repo {name}")
+
+    def _create(self):
+        name = f"{REPO_POOL_PREFIX}{uuid.uuid4().hex[:12]}"
+        with self.lock, self.conn:
+            self.conn.execute("INSERT INTO repo_pool (name, status, created_at) VALUES (?, 'creating', ?)",
+                              (name, time.time()))
+        try:
+            self.bootstrap(name)
+        except Exception:
+            self._set_status(name, "deleting")
+            raise
+        self._set_status(name, "ready")
+        log(f"Pooled repo {name} ready")
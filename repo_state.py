@@ -0,0 +1,54 @@
+import os
+import hashlib
+import threading
+from collections import OrderedDict
+
+REPO_STATE_ENTRIES = int(os.getenv("REPO_STATE_ENTRIES", "512"))
+
+
+def git_blob_sha(content: bytes) -> str:
+    """
+    The SHA git (and GitHub) assigns to a file with this content.
+    """
+    return hashlib.sha1(b"blob %d\0" % len(content) + content).hexdigest()
+
+
+class RepoStateCache:
+    """
+    What this process last wrote to each repo's main branch: head commit,
+    root tree and blob SHA per path. Pushes read it instead of asking GitHub
+    for refs and file SHAs; on a 409/422 the entry is dropped and the
+    caller re-reads from the API.
+    """
+
+    def __init__(self, max_entries: int = REPO_STATE_ENTRIES):
+        self.max_entries = max_entries
+        self.repos = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, repo_name: str):
+        with self.lock:
+            state = self.repos.get(repo_name)
+            if state is None:
+                return None
+            self.repos.move_to_end(repo_name)
+            return {"head": state["head"], "tree": state["tree"], "blobs": dict(state["blobs"])}
+
+    def record(self, repo_name: str, head: str, tree: str = None, blobs: dict = None):
+        with self.lock:
+            state = self.repos.get(repo_name) or {"head": None, "tree": None, "blobs": {}}
+            state["head"] = head
+            # A commit without a known tree leaves the cached tree stale
+            state["tree"] = tree
+            state["blobs"].update(blobs or {})
+            self.repos[repo_name] = state
+            self.repos.move_to_end(repo_name)
+            while len(self.repos) > self.max_entries:
+                self.repos.popitem(last=False)
+
+    def invalidate(self, repo_name: str):
+        with self.lock:
+            self.repos.pop(repo_name, None)
+
+
+repo_state = RepoStateCache()
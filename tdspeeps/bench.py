@@ -0,0 +1,230 @@
+# /// script
+# requires-python = ">=3.11"
+# dependencies = [
+#   "fastapi[standard]",
+#   "uvicorn",
+#   "requests",
+# ]
+# ///
+"""
+Offline load test: starts local stubs for GitHub, the LLM and the evaluator,
+points the app at them and replays a task mix through the job queue.
+
+    python tdspeeps/bench.py --tasks 200 --concurrency 16 --mix 1:0.5,2:0.5 \\
+        --subrounds 3 --llm 1500:0.4 --github 80:0.3:0.01
+
+Reports throughput plus p50/p95/p99 of end-to-end and per-stage latency.
+"""
+import os
+import sys
+import json
+import math
+import time
+import random
+import argparse
+import tempfile
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+sys.path.insert(0, os.path.dirname(HERE))
+
+from stubs import Profile, GitHubStub, LLMStub, EvaluationStub, start_stub
+from requestor import make_task
+
+
+def percentile(values: list, p: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, math.ceil(p / 100 * len(ordered)) - 1))
+    return ordered[rank]
+
+
+def summarize(values: list) -> dict:
+    return {
+        "count": len(values),
+        "p50": round(percentile(values, 50), 4),
+        "p95": round(percentile(values, 95), 4),
+        "p99": round(percentile(values, 99), 4),
+    }
+
+
+def parse_mix(spec: str) -> list:
+    mix = []
+    for part in spec.split(","):
+        round_no, weight = part.split(":")
+        mix.append((int(round_no), float(weight)))
+    return mix
+
+
+def start_environment(args) -> dict:
+    """
+    Start the stubs and export the env the app reads at import time.
+    Must run before app is imported.
+    """
+    model_profiles = {}
+    if args.llm_fast:
+        # Routing is off unless a fast model is configured
+        os.environ.setdefault("LLM_FAST_MODEL", "gpt-4o-mini")
+        model_profiles[os.environ["LLM_FAST_MODEL"]] = Profile.parse(args.llm_fast)
+    servers = {
+        "github": start_stub(GitHubStub, Profile.parse(args.github), quota=args.github_quota,
+                             window_seconds=args.github_window, pages_delay=args.pages_delay),
+        "llm": start_stub(LLMStub, Profile.parse(args.llm), fence_rate=args.llm_fence_rate,
+                          model_profiles=model_profiles),
+        "evaluation": start_stub(EvaluationStub, Profile.parse(args.evaluation)),
+    }
+    workdir = tempfile.mkdtemp(prefix="tds-bench-")
+    os.environ["GITHUB_API_URL"] = servers["github"][1]
+    os.environ["LLM_API_URL"] = servers["llm"][1] + "/openai/v1/chat/completions"
+    os.environ["JOB_DB_PATH"] = os.path.join(workdir, "jobs.db")
+    os.environ["LLM_CACHE_DIR"] = os.path.join(workdir, "llm_cache")
+    os.environ["MAX_WORKERS"] = str(args.concurrency)
+    os.environ.setdefault("SECRET_KEY", "bench")
+    if args.repo_pool:
+        os.environ["REPO_POOL_SIZE"] = str(args.repo_pool)
+        os.environ["REPO_POOL_REFILL_PER_MINUTE"] = "6000"
+    if args.candidates > 1:
+        os.environ["LLM_CANDIDATES"] = str(args.candidates)
+    return servers
+
+
+def run(args) -> dict:
+    servers = start_environment(args)
+    import app
+    from fair_queue import QueueFull
+
+    mix = parse_mix(args.mix)
+    if args.repo_pool:
+        # Start from a full pool, as a long-running service would
+        while app.repo_pool.stats().get("ready", 0) < args.repo_pool:
+            time.sleep(0.05)
+    rounds = [r for r, _ in mix]
+    weights = [w for _, w in mix]
+    evaluation_url = servers["evaluation"][1] + "/notify"
+
+    submitted = []
+    tenants = {}
+    rejected = 0
+    start = time.perf_counter()
+    for i in range(args.tasks):
+        round_no = random.choices(rounds, weights)[0]
+        data = make_task(round=round_no, subrounds=args.subrounds, attachment_kb=args.attachment_kb,
+                         evaluation_url=evaluation_url, task=f"bench-{i}", nonce=f"n{random.getrandbits(32):08x}")
+        data["email"] = f"tenant-{i % args.tenants}@example.com"
+        data["no_cache"] = not args.cache
+        data["fold_subrounds"] = args.fold
+        pipeline = app.round1 if round_no == 1 else app.round2
+        while True:
+            try:
+                job, _ = app.job_queue.submit(pipeline, data)
+                break
+            except QueueFull as e:
+                # A real client would wait out Retry-After; keep the bench short
+                rejected += 1
+                time.sleep(min(e.retry_after, 0.5))
+        submitted.append(job["id"])
+        tenants[job["id"]] = data["email"]
+
+    finished = {}
+    while len(finished) < len(submitted):
+        for job_id in submitted:
+            if job_id in finished:
+                continue
+            job = app.job_queue.get(job_id)
+            if job and job["status"] in ("done", "failed"):
+                finished[job_id] = job
+        time.sleep(0.05)
+    wall = time.perf_counter() - start
+
+    # Evaluation callbacks are delivered in the background; wait for them to settle
+    while True:
+        callbacks = [c for job_id in submitted for c in app.outbox.deliveries(job_id)]
+        if not any(c["status"] in ("held", "pending") for c in callbacks):
+            break
+        time.sleep(0.05)
+    drained = time.perf_counter() - start
+
+    jobs = list(finished.values())
+    stages = {}
+    for job in jobs:
+        for name, seconds in job["timings"].items():
+            stages.setdefault(name, []).append(seconds)
+    failed = [j for j in jobs if j["status"] == "failed"]
+    return {
+        "tasks": len(jobs),
+        "failed": len(failed),
+        "errors": sorted({j["error"] for j in failed})[:5],
+        "wall_seconds": round(wall, 3),
+        "throughput_per_second": round(len(jobs) / wall, 3) if wall else 0.0,
+        "rejected": rejected,
+        "tenants": {tenant: summarize([j["finished_at"] - j["submitted_at"] for j in jobs
+                                       if tenants[j["id"]] == tenant])
+                    for tenant in sorted(set(tenants.values()))} if args.tenants > 1 else {},
+        "callbacks": {"delivered": sum(c["status"] == "delivered" for c in callbacks),
+                      "failed": sum(c["status"] == "failed" for c in callbacks),
+                      "drained_seconds": round(drained, 3)},
+        "llm_models": app.llm_router.snapshot()["models"],
+        "end_to_end": summarize([j["finished_at"] - j["submitted_at"] for j in jobs]),
+        "stages": {name: summarize(values) for name, values in sorted(stages.items())},
+    }
+
+
+def print_report(report: dict):
+    print(f"tasks={report['tasks']} failed={report['failed']} rejected={report['rejected']} "
+          f"wall={report['wall_seconds']}s throughput={report['throughput_per_second']}/s")
+    for tenant, stats in report["tenants"].items():
+        print(f"{tenant}: end_to_end p50={stats['p50']} p95={stats['p95']}")
+    callbacks = report["callbacks"]
+    print(f"callbacks delivered={callbacks['delivered']} failed={callbacks['failed']} "
+          f"drained={callbacks['drained_seconds']}s")
+    for model, stats in report["llm_models"].items():
+        print(f"llm {model}: requests={stats['requests']} errors={stats['errors']} p50={stats['p50_seconds']} "
+              f"p95={stats['p95_seconds']} hedged={stats['hedged']} hedge_wins={stats['hedge_wins']}")
+    for error in report["errors"]:
+        print(f"  error: {error}")
+    print(f"{'stage':<20}{'count':>8}{'p50':>10}{'p95':>10}{'p99':>10}")
+    rows = [("end_to_end", report["end_to_end"])] + list(report["stages"].items())
+    for name, s in rows:
+        print(f"{name:<20}{s['count']:>8}{s['p50']:>10.3f}{s['p95']:>10.3f}{s['p99']:>10.3f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline load test for the task pipeline")
+    parser.add_argument("--tasks", type=int, default=50)
+    parser.add_argument("--concurrency", type=int, default=8, help="worker pool size (MAX_WORKERS)")
+    parser.add_argument("--mix", default="1:0.5,2:0.5", help="round:weight pairs")
+    parser.add_argument("--subrounds", type=int, default=3, help="subrounds per round-2 task")
+    parser.add_argument("--attachment-kb", type=int, default=0, help="size of each generated attachment")
+    parser.add_argument("--github", default="80:0.3:0", help="median_ms:sigma:error_rate[:status]")
+    parser.add_argument("--github-quota", type=int, default=0,
+                        help="GitHub calls per rate-limit window (0 = unlimited, no headers)")
+    parser.add_argument("--github-window", type=float, default=3600.0, help="rate-limit window in seconds")
+    parser.add_argument("--pages-delay", type=float, default=0.0, help="seconds a Pages build takes per push")
+    parser.add_argument("--llm", default="1500:0.4:0")
+    parser.add_argument("--llm-fast", default=None,
+                        help="route to a fast model with this latency profile, same format as --llm (default: no routing)")
+    parser.add_argument("--llm-fence-rate", type=float, default=0.0,
+                        help="fraction of LLM replies wrapped in a markdown fence")
+    parser.add_argument("--evaluation", default="50:0.3:0")
+    parser.add_argument("--cache", action="store_true", help="let the LLM cache serve repeats")
+    parser.add_argument("--repo-pool", type=int, default=0, help="warm repos kept ready for round 1")
+    parser.add_argument("--fold", action="store_true", help="fold round-2 subrounds into one commit")
+    parser.add_argument("--tenants", type=int, default=1, help="distinct submitter emails, round-robin")
+    parser.add_argument("--candidates", type=int, default=1,
+                        help="round-1 candidates generated and checked locally (needs node + jsdom)")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--json", help="also write the report to this file")
+    args = parser.parse_args()
+    if args.seed is not None:
+        random.seed(args.seed)
+
+    report = run(args)
+    print_report(report)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
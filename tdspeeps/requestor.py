@@ -7,43 +7,84 @@
 # ]
 # ///
 import os
+import base64
+import random
+import struct
 import requests
 
-def send_task():
+ROUND2_SUBROUNDS = [
+    {
+    "brief": "Show an aria-live alert #github-status that reports when a lookup starts, succeeds, or fails.",
+    "checks": [
+        "document.querySelector('#github-status').getAttribute('aria-live') === 'polite'",
+        "!!document.querySelector('script').textContent.includes('github-status')"
+    ]
+    },
+    {
+    "brief": "Display the account age in whole years inside #github-account-age alongside the creation date.",
+    "checks": [
+        "parseInt(document.querySelector('#github-account-age').textContent, 10) >= 0",
+        "document.querySelector('#github-account-age').textContent.toLowerCase().includes('years')"
+    ]
+    },
+    {
+    "brief": "Cache the last successful lookup in localStorage under 'github-user-${seed}' and repopulate the form on load.",
+    "checks": [
+        "!!document.querySelector('script').textContent.includes('localStorage.setItem(\"github-user-${seed}\")')",
+        "!!document.querySelector('script').textContent.includes('localStorage.getItem(\"github-user-${seed}\")')"
+    ]
+    }
+]
+
+
+def make_attachment(name: str, size_kb: int, binary: bool) -> dict:
+    if binary:
+        # PNG signature + IHDR so the service can read dimensions; the rest is noise
+        header = b"\x89PNG\r\n\x1a\n" + struct.pack(">I4sII", 13, b"IHDR", 640, 480)
+        raw = (header + random.randbytes(size_kb * 1024))[:size_kb * 1024]
+        mime = "image/png"
+    else:
+        rows = ["id,name,value"] + [f"{i},item-{i},{random.randint(0, 1000)}" for i in range(size_kb * 50)]
+        raw = "\n".join(rows).encode("utf-8")[:size_kb * 1024]
+        mime = "text/csv"
+    return {"name": name, "url": f"data:{mime};base64,{base64.b64encode(raw).decode('ascii')}"}
+
+
+def make_task(round: int = 2, subrounds: int = 3, attachment_kb: int = 0,
+              evaluation_url: str = "https://example.com/notify", task: str = "captcha-solver-...",
+              nonce: str = "ab12-...") -> dict:
+    """
+    Build a /handle_task payload. Round 2 cycles through the sample subrounds,
+    attachment_kb > 0 adds one CSV and one binary attachment of that size.
+    """
     payload={
         "email": "student@example.com",
         "secret": os.getenv("SECRET_KEY"),
-        "task": "captcha-solver-...",
-        "round": 2,
-        "nonce": "ab12-...",
+        "task": task,
+        "round": round,
+        "nonce": nonce,
         "brief": "Create a captcha solver that handles ?url=https://.../image.png. Default to attached sample.",
-        "round2": [
-            {
-            "brief": "Show an aria-live alert #github-status that reports when a lookup starts, succeeds, or fails.",
-            "checks": [
-                "document.querySelector('#github-status').getAttribute('aria-live') === 'polite'",
-                "!!document.querySelector('script').textContent.includes('github-status')"
-            ]
-            },
-            {
-            "brief": "Display the account age in whole years inside #github-account-age alongside the creation date.",
-            "checks": [
-                "parseInt(document.querySelector('#github-account-age').textContent, 10) >= 0",
-                "document.querySelector('#github-account-age').textContent.toLowerCase().includes('years')"
-            ]
-            },
-            {
-            "brief": "Cache the last successful lookup in localStorage under 'github-user-${seed}' and repopulate the form on load.",
-            "checks": [
-                "!!document.querySelector('script').textContent.includes('localStorage.setItem(\"github-user-${seed}\")')",
-                "!!document.querySelector('script').textContent.includes('localStorage.getItem(\"github-user-${seed}\")')"
-            ]
-            }
-        ],
-        "evaluation_url": "https://example.com/notify",
+        "evaluation_url": evaluation_url,
         }
-    response = requests.post("http://localhost:8000/handle_task", json=payload)
+    attachments = []
+    if attachment_kb:
+        attachments = [make_attachment("data.csv", attachment_kb, False),
+                       make_attachment("sample.png", attachment_kb, True)]
+    if round == 1:
+        payload["attachments"] = attachments
+        payload["checks"] = ROUND2_SUBROUNDS[0]["checks"]
+    else:
+        payload["round2"] = [dict(ROUND2_SUBROUNDS[i % len(ROUND2_SUBROUNDS)]) for i in range(subrounds)]
+        if attachments:
+            payload["round2"][0]["attachments"] = attachments
+    return payload
+
+
+def send_task(payload: dict = None, url: str = "http://localhost:8000/handle_task"):
+    payload = payload or make_task()
+    response = requests.post(url, json=payload)
     print(response.json() )
+    return response
 
 if __name__ == "__main__":
-    send_task()
\ No newline at end of file
+    send_task()
@@ -0,0 +1,344 @@
+"""
+Local stand-ins for the upstreams the service talks to (GitHub REST API,
+aipipe chat completions, evaluation URL), so the pipeline can be load
+tested without network. Each stub sleeps according to a latency profile
+and fails a configurable fraction of requests.
+"""
+import copy
+import json
+import time
+import base64
+import random
+import hashlib
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+SAMPLE_HTML = """<!DOCTYPE html>
+<html>
+<head><title>Stub app</title></head>
+<body>
+<div id="github-status" aria-live="polite"></div>
+<div id="github-account-age">0 years</div>
+<script>
+document.getElementById('github-status').textContent = 'github-status ready';
+</script>
+</body>
+</html>"""
+
+
+class Profile:
+    """
+    Latency is lognormal around median_ms (sigma controls the tail),
+    error_rate of requests get error_status instead of a real response.
+    """
+
+    def __init__(self, median_ms: float = 50, sigma: float = 0.3, error_rate: float = 0.0,
+                 error_status: int = 500):
+        self.median_ms = median_ms
+        self.sigma = sigma
+        self.error_rate = error_rate
+        self.error_status = error_status
+
+    @classmethod
+    def parse(cls, spec: str):
+        """
+        "median_ms[:sigma[:error_rate[:error_status]]]", e.g. "80:0.5:0.01".
+        """
+        parts = spec.split(":")
+        kwargs = {}
+        for key, cast, value in zip(("median_ms", "sigma", "error_rate", "error_status"),
+                                    (float, float, float, int), parts):
+            if value:
+                kwargs[key] = cast(value)
+        return cls(**kwargs)
+
+    def delay(self):
+        if self.median_ms > 0:
+            time.sleep(self.median_ms / 1000 * random.lognormvariate(0, self.sigma))
+
+    def should_fail(self) -> bool:
+        return random.random() < self.error_rate
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    profile = Profile()
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def handle(self):
+        try:
+            super().handle()
+        except (BrokenPipeError, ConnectionResetError):
+            # Client hung up, e.g. a hedged LLM request that lost
+            pass
+
+    def read_json(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length) if length else b""
+        try:
+            return json.loads(body) if body else {}
+        except ValueError:
+            return {}
+
+    def send_json(self, status: int, payload):
+        self.send_body(status, json.dumps(payload).encode("utf-8"), "application/json")
+
+    def send_body(self, status: int, body: bytes, content_type: str):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def handle_any(self, method: str):
+        payload = self.read_json()
+        profile = self.profile_for(payload)
+        profile.delay()
+        if profile.should_fail():
+            self.send_json(profile.error_status, {"message": "stub failure"})
+            return
+        self.route(method, self.path.split("?", 1)[0], payload)
+
+    def profile_for(self, payload: dict) -> Profile:
+        return self.profile
+
+    def route(self, method: str, path: str, payload: dict):
+        self.send_json(200, {})
+
+    def do_GET(self):
+        self.handle_any("GET")
+
+    def do_POST(self):
+        self.handle_any("POST")
+
+    def do_PUT(self):
+        self.handle_any("PUT")
+
+    def do_PATCH(self):
+        self.handle_any("PATCH")
+
+    def do_DELETE(self):
+        self.handle_any("DELETE")
+
+
+def blob_sha(content: bytes) -> str:
+    return hashlib.sha1(b"blob %d\0" % len(content) + content).hexdigest()
+
+
+def fake_sha(*parts) -> str:
+    return hashlib.sha1("|".join(str(p) for p in parts).encode("utf-8")).hexdigest()
+
+
+class GitHubStub(StubHandler):
+    """
+    Just enough of the REST API for create_repo, enable_pages, repo renames and
+    deletes (the warm pool) and both push modes.
+    Repos keep a head commit and per-path blob SHAs so round 2 sees round 1's state;
+    repos that were never created start out with SAMPLE_HTML as index.html.
+    """
+    repos = {}
+    lock = threading.Lock()
+    # Calls allowed per rate-limit window; 0 sends no rate-limit headers
+    quota = 0
+    window_seconds = 3600.0
+    usage = {"used": 0, "reset": 0.0}
+    # Seconds a Pages build takes after each push
+    pages_delay = 0.0
+
+    def handle_any(self, method: str):
+        if self.quota:
+            with self.lock:
+                now = time.time()
+                if now >= self.usage["reset"]:
+                    self.usage.update(used=0, reset=now + self.window_seconds)
+                self.usage["used"] += 1
+                self.remaining = self.quota - self.usage["used"]
+            if self.remaining < 0:
+                self.read_json()
+                return self.send_json(403, {"message": "API rate limit exceeded"})
+        super().handle_any(method)
+
+    def end_headers(self):
+        if self.quota:
+            self.send_header("X-RateLimit-Limit", str(self.quota))
+            self.send_header("X-RateLimit-Remaining", str(max(self.remaining, 0)))
+            self.send_header("X-RateLimit-Reset", str(int(self.usage["reset"])))
+        super().end_headers()
+
+    def repo(self, name: str) -> dict:
+        with self.lock:
+            repo = self.repos.get(name)
+            if repo is None:
+                head = fake_sha(name, "init")
+                repo = {"head": head, "tree": fake_sha(head, "tree"),
+                        "files": {"index.html": blob_sha(SAMPLE_HTML.encode("utf-8"))},
+                        "contents": {"index.html": SAMPLE_HTML}}
+                self.repos[name] = repo
+            return repo
+
+    def commit(self, repo: dict, message: str) -> str:
+        with self.lock:
+            repo["pushed_at"] = time.time()
+            repo["head"] = fake_sha(repo["head"], message, time.time())
+            repo["tree"] = fake_sha(repo["head"], "tree")
+            return repo["head"]
+
+    def edit_repo(self, method: str, name: str, payload: dict):
+        # Rename (as used to claim a warm repo) or delete
+        with self.lock:
+            if name not in self.repos:
+                return self.send_json(404, {"message": "Not Found"})
+            if method == "DELETE":
+                del self.repos[name]
+                return self.send_body(204, b"", "application/json")
+            new_name = payload.get("name", name)
+            if new_name != name and new_name in self.repos:
+                return self.send_json(422, {"message": "name already exists on this account"})
+            self.repos[new_name] = self.repos.pop(name)
+        return self.send_json(200, {"name": new_name})
+
+    def route(self, method: str, path: str, payload: dict):
+        parts = path.strip("/").split("/")
+        if method == "POST" and path == "/user/repos":
+            self.repo(payload.get("name"))
+            return self.send_json(201, {"name": payload.get("name")})
+        if len(parts) == 3 and parts[0] == "repos" and method in ("PATCH", "DELETE"):
+            return self.edit_repo(method, parts[2], payload)
+        if len(parts) < 4 or parts[0] != "repos":
+            return self.send_json(404, {"message": "Not Found"})
+        repo = self.repo(parts[2])
+        rest = parts[3:]
+        if rest == ["pages"] and method == "POST":
+            return self.send_json(201, {"status": "queued"})
+        if rest == ["pages", "builds", "latest"]:
+            building = time.time() - repo.get("pushed_at", 0.0) < self.pages_delay
+            return self.send_json(200, {"status": "building" if building else "built", "commit": repo["head"]})
+        if rest[:2] == ["git", "ref"] or rest[:2] == ["git", "refs"]:
+            if method == "GET":
+                return self.send_json(200, {"object": {"sha": repo["head"]}})
+            repo["head"] = payload.get("sha", repo["head"])
+            repo["pushed_at"] = time.time()
+            return self.send_json(200, {"object": {"sha": repo["head"]}})
+        if rest[:2] == ["git", "commits"]:
+            if method == "GET":
+                return self.send_json(200, {"sha": rest[2], "tree": {"sha": repo["tree"]}})
+            sha = fake_sha(payload.get("tree"), payload.get("message"), time.time())
+            return self.send_json(201, {"sha": sha})
+        if rest[:2] == ["git", "blobs"]:
+            return self.send_json(201, {"sha": blob_sha(base64.b64decode(payload.get("content", "")))})
+        if rest[:2] == ["git", "trees"] and method == "GET":
+            entries = [{"path": p, "type": "blob", "sha": sha} for p, sha in repo["files"].items()]
+            return self.send_json(200, {"sha": rest[2], "tree": entries})
+        if rest[:2] == ["git", "trees"]:
+            for entry in payload.get("tree", []):
+                repo["files"][entry["path"]] = entry.get("sha") or blob_sha(entry.get("content", "").encode("utf-8"))
+                if entry.get("content") is not None:
+                    repo["contents"][entry["path"]] = entry["content"]
+            entries = [{"path": e["path"], "sha": repo["files"][e["path"]]} for e in payload.get("tree", [])]
+            return self.send_json(201, {"sha": fake_sha(payload.get("base_tree"), time.time()), "tree": entries})
+        if rest[0] == "contents":
+            file_path = "/".join(rest[1:])
+            if method == "GET":
+                if file_path not in repo["files"]:
+                    return self.send_json(404, {"message": "Not Found"})
+                if "raw" in self.headers.get("Accept", ""):
+                    raw = repo["contents"].get(file_path, "").encode("utf-8")
+                    return self.send_body(200, raw, "text/plain; charset=utf-8")
+                return self.send_json(200, {"sha": repo["files"][file_path]})
+            repo["files"][file_path] = blob_sha(base64.b64decode(payload.get("content", "")))
+            try:
+                repo["contents"][file_path] = base64.b64decode(payload.get("content", "")).decode("utf-8")
+            except ValueError:
+                pass
+            sha = self.commit(repo, payload.get("message"))
+            return self.send_json(201, {"commit": {"sha": sha}, "content": {"sha": repo["files"][file_path]}})
+        return self.send_json(404, {"message": "Not Found"})
+
+
+class LLMStub(StubHandler):
+    """
+    Chat completions endpoint that answers with SAMPLE_HTML, or with a small
+    SEARCH/REPLACE edit when the prompt asks for edit blocks. Streams SSE
+    chunks when asked to; fence_rate of replies come wrapped in a markdown
+    fence so early validation and retries can be exercised. model_profiles
+    gives individual models their own latency, for routing and hedging.
+    """
+    content = SAMPLE_HTML
+    edit = "<<<<<<< SEARCH\n</title>\n=======\n</title><!-- edited -->\n>>>>>>> REPLACE"
+    fence_rate = 0.0
+    chunk_chars = 16
+    chunk_delay = 0.002
+    # model name -> Profile, for models that answer faster or slower than the default
+    model_profiles = {}
+
+    def profile_for(self, payload: dict) -> Profile:
+        return self.model_profiles.get(payload.get("model"), self.profile)
+
+    def route(self, method: str, path: str, payload: dict):
+        prompt = "".join(str(m.get("content", "")) for m in payload.get("messages", []))
+        prompt_tokens = len(prompt) // 4
+        content = self.edit if "<<<<<<< SEARCH" in prompt else self.content
+        if random.random() < self.fence_rate:
+            content = f"```html\n{content}\n```"
+        usage = {"prompt_tokens": prompt_tokens, "completion_tokens": len(content) // 4}
+        if payload.get("stream"):
+            return self.send_stream(payload.get("model"), content, usage)
+        self.send_json(200, {
+            "model": payload.get("model"),
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content},
+                         "finish_reason": "stop"}],
+            "usage": usage,
+        })
+
+    def send_stream(self, model: str, content: str, usage: dict):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        def event(payload):
+            data = f"data: {payload}\n\n".encode("utf-8")
+            self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+            self.wfile.flush()
+
+        try:
+            for i in range(0, len(content), self.chunk_chars):
+                delta = content[i:i + self.chunk_chars]
+                event(json.dumps({"model": model, "choices": [{"index": 0, "delta": {"content": delta}}]}))
+                time.sleep(self.chunk_delay)
+            event(json.dumps({"model": model, "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]}))
+            event(json.dumps({"model": model, "choices": [], "usage": usage}))
+            event("[DONE]")
+            self.wfile.write(b"0\r\n\r\n")
+        except (BrokenPipeError, ConnectionResetError):
+            # Client cancelled the stream
+            self.close_connection = True
+
+
+class EvaluationStub(StubHandler):
+    received = []
+    lock = threading.Lock()
+
+    def route(self, method: str, path: str, payload: dict):
+        with self.lock:
+            self.received.append(payload)
+        self.send_json(200, {"ok": True})
+
+
+def start_stub(handler: type, profile: Profile, host: str = "127.0.0.1", port: int = 0, **options):
+    """
+    Start a stub server on a background thread; returns (server, base_url).
+    A fresh handler subclass is used so each server keeps its own profile and state;
+    options override handler class attributes (e.g. fence_rate).
+    """
+    attrs = dict(options, profile=profile)
+    for name in ("repos", "received", "usage"):
+        if hasattr(handler, name):
+            attrs[name] = copy.deepcopy(getattr(handler, name))
+    bound = type(handler.__name__, (handler,), attrs)
+    server = ThreadingHTTPServer((host, port), bound)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}"
@@ -0,0 +1,56 @@
+import base64
+import struct
+
+import attachments
+from attachments import parse_attachments, image_dimensions
+
+
+def parse_one(mime: str, payload: str) -> dict:
+    files = parse_attachments({"attachments": [{"name": "file", "url": f"data:{mime};base64,{payload}"}]})
+    assert len(files) == 1
+    return files[0]
+
+
+def test_base64_with_whitespace_and_missing_padding():
+    payload = base64.b64encode(b"hello world").decode().rstrip("=")
+    file = parse_one("text/plain", payload[:6] + "\n  " + payload[6:])
+    assert file["content"] == "hello world"
+    assert not file["binary"]
+
+
+def test_utf8_sequence_split_across_chunks(monkeypatch):
+    # 8 base64 characters are 6 bytes, so "é" (2 bytes at offset 5) straddles two chunks
+    monkeypatch.setattr(attachments, "DECODE_CHUNK", 8)
+    text = "abcdeé and more text ✓"
+    file = parse_one("text/plain", base64.b64encode(text.encode("utf-8")).decode())
+    assert file["content"] == text
+    assert file["size"] == len(text.encode("utf-8"))
+
+
+def test_text_mime_that_isnt_utf8_stays_binary():
+    raw = "café".encode("latin-1")
+    payload = base64.b64encode(raw).decode()
+    file = parse_one("text/plain", payload)
+    assert file["binary"]
+    assert file["content"] == payload
+    assert file["size"] == len(raw)
+
+
+def binary_file(raw: bytes) -> dict:
+    return {"name": "image", "binary": True, "content": base64.b64encode(raw).decode()}
+
+
+def test_png_dimensions():
+    header = b"\x89PNG\r\n\x1a\n" + struct.pack(">I", 13) + b"IHDR" + struct.pack(">II", 640, 480)
+    assert image_dimensions(binary_file(header + b"\0" * 16)) == (640, 480)
+
+
+def test_jpeg_dimensions():
+    app0 = b"\xff\xe0" + struct.pack(">H", 16) + b"JFIF\0" + b"\0" * 9
+    sof0 = b"\xff\xc0" + struct.pack(">HBHH", 17, 8, 300, 1024) + b"\0" * 10
+    assert image_dimensions(binary_file(b"\xff\xd8" + app0 + sof0)) == (1024, 300)
+
+
+def test_dimensions_of_text_or_unknown_data():
+    assert image_dimensions({"name": "a.txt", "binary": False, "content": "hello"}) is None
+    assert image_dimensions(binary_file(b"not an image at all")) is None
@@ -0,0 +1,31 @@
+import pytest
+
+from code_edits import parse_edits, apply_edits
+
+SOURCE = "<html>\n<body>\n  <h1>Title</h1>  \n  <p>Old</p>\n</body>\n</html>\n"
+
+
+def edit_block(search: str, replace: str) -> str:
+    return f"<<<<<<< SEARCH\n{search}\n=======\n{replace}\n>>>>>>> REPLACE"
+
+
+def test_exact_match():
+    edits = parse_edits(edit_block("  <p>Old</p>", "  <p>New</p>"))
+    assert apply_edits(SOURCE, edits) == SOURCE.replace("<p>Old</p>", "<p>New</p>")
+
+
+def test_match_ignores_trailing_whitespace():
+    # The source has trailing spaces after </h1>, the search text doesn't
+    edits = parse_edits(edit_block("  <h1>Title</h1>\n  <p>Old</p>", "  <h1>Other</h1>"))
+    assert apply_edits(SOURCE, edits) == "<html>\n<body>\n  <h1>Other</h1>\n</body>\n</html>\n"
+
+
+def test_empty_replacement_deletes():
+    edits = parse_edits(edit_block("  <p>Old</p>\n", ""))
+    assert edits == [("  <p>Old</p>\n", "")]
+    assert apply_edits(SOURCE, edits) == "<html>\n<body>\n  <h1>Title</h1>  \n</body>\n</html>\n"
+
+
+def test_missing_search_raises():
+    with pytest.raises(ValueError, match="not found"):
+        apply_edits(SOURCE, parse_edits(edit_block("<p>Nowhere</p>", "")))
@@ -0,0 +1,52 @@
+import threading
+
+from fair_queue import FairQueue
+
+
+def get_within(queue: FairQueue, timeout: float = 0.5):
+    """
+    queue.get(), or None if it's still blocked after timeout seconds.
+    """
+    result = []
+    thread = threading.Thread(target=lambda: result.append(queue.get()), daemon=True)
+    thread.start()
+    thread.join(timeout)
+    return result[0] if result else None
+
+
+def test_tenant_alone_gets_every_worker():
+    queue = FairQueue(workers=4, tenant_max_running=2, weights={})
+    for i in range(4):
+        queue.put("a", i)
+    assert [get_within(queue) for _ in range(4)] == [("a", 0), ("a", 1), ("a", 2), ("a", 3)]
+
+
+def test_cap_applies_while_another_tenant_waits():
+    queue = FairQueue(workers=4, tenant_max_running=2, weights={})
+    for i in range(4):
+        queue.put("a", i)
+    assert get_within(queue) == ("a", 0)
+    assert get_within(queue) == ("a", 1)
+    # b's job has the later finish tag, but a is at its cap while b waits
+    queue.put("b", 0, cost=10)
+    assert get_within(queue) == ("b", 0)
+    # Nobody else waiting: a may go past its cap again
+    assert get_within(queue) == ("a", 2)
+
+
+def test_capped_tenants_wait_for_done():
+    queue = FairQueue(workers=2, tenant_max_running=1, weights={})
+    queue.put("a", 0)
+    queue.put("a", 1)
+    queue.put("b", 0)
+    queue.put("b", 1)
+    assert {get_within(queue), get_within(queue)} == {("a", 0), ("b", 0)}
+    # Both tenants are at their cap and both have jobs waiting
+    result = []
+    waiting = threading.Thread(target=lambda: result.append(queue.get()), daemon=True)
+    waiting.start()
+    waiting.join(0.2)
+    assert not result
+    queue.done("a")
+    waiting.join(0.5)
+    assert result == [("a", 1)]